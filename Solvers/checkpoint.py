@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import numpy
+import pickle
+import random
+
+"""
+This file contains the binary checkpoints used to restart the solvers. A
+checkpoint is a pickled dictionary holding a metadata header and the solver
+state. Checkpoints are written to a temporary file that is synced and then
+renamed over the previous checkpoint, so an interruption while writing
+leaves the last complete checkpoint in place.
+"""
+
+CHECKPOINT_VERSION = 1
+
+
+def capture_rng_state():
+    """
+    Returns the state of the Python and NumPy random number generators, and
+    of the torch generators if torch has been imported, e.g. by
+    stable_baselines3 to sample actions.
+    """
+    rng_state = {'python': random.getstate(),
+                 'numpy': numpy.random.get_state()}
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        rng_state['torch'] = torch.get_rng_state()
+        if torch.cuda.is_available():
+            rng_state['torch_cuda'] = torch.cuda.get_rng_state_all()
+
+    return rng_state
+
+
+def restore_rng_state(rng_state):
+    """
+    Restores the random number generators to a state from capture_rng_state.
+    """
+    random.setstate(rng_state['python'])
+    numpy.random.set_state(rng_state['numpy'])
+    torch = sys.modules.get('torch')
+    if torch is not None and 'torch' in rng_state:
+        torch.set_rng_state(rng_state['torch'])
+        if 'torch_cuda' in rng_state and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(rng_state['torch_cuda'])
+
+
+def write_checkpoint(file_name, solver, generation, state):
+    """
+    Atomically writes a checkpoint.
+
+    Parameters:
+        file_name: str
+            Path of the checkpoint.
+        solver: str
+            Name of the solver that wrote the checkpoint.
+        generation: int
+            Last generation completed before the checkpoint.
+        state: dict
+            Solver state to save. Must be picklable.
+    """
+    checkpoint = {'metadata': {'version': CHECKPOINT_VERSION,
+                               'solver': solver,
+                               'generation': generation,
+                               'time': time.time()},
+                  'state': state}
+    temp_name = f"{file_name}.tmp"
+    with open(temp_name, 'wb') as ofile:
+        pickle.dump(checkpoint, ofile, protocol=pickle.HIGHEST_PROTOCOL)
+        ofile.flush()
+        os.fsync(ofile.fileno())
+    os.replace(temp_name, file_name)
+
+
+def read_checkpoint(file_name, solver):
+    """
+    Reads a checkpoint written by write_checkpoint and returns its metadata
+    and state.
+
+    Raises a ValueError if the checkpoint was written by another solver or
+    by an incompatible version.
+    """
+    with open(file_name, 'rb') as ifile:
+        checkpoint = pickle.load(ifile)
+    metadata = checkpoint['metadata']
+    if metadata['version'] != CHECKPOINT_VERSION:
+        raise ValueError(f"Checkpoint {file_name} has version {metadata['version']}, "
+                         f"expected {CHECKPOINT_VERSION}.")
+    if metadata['solver'] != solver:
+        raise ValueError(f"Checkpoint {file_name} was written by {metadata['solver']}, not {solver}.")
+
+    return metadata, checkpoint['state']
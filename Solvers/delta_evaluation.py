@@ -0,0 +1,100 @@
+from midas.utils.solution_types import evaluate_function
+
+"""
+This file contains the optional delta evaluation protocol. A solution class
+may define
+
+    evaluate_delta(parent, changed_positions)
+
+which evaluates the solution starting from the results of an already
+evaluated parent that differs from it only at changed_positions, reusing the
+expensive setup (cross section libraries, input decks, geometry) and only
+recomputing what the changed positions affect. The solvers use it whenever
+the solution class defines it and the parent of a solution is known, and
+fall back to a full evaluation otherwise.
+
+Positions are genome indices for list genomes, (key, index) pairs for
+dictionary genomes of lists and keys for dictionaries of single values, such
+as the core states of the reinforcement learning environments.
+"""
+
+
+def supports_delta(solution):
+    """
+    Returns True if the solution class implements evaluate_delta.
+    """
+    return callable(getattr(solution, 'evaluate_delta', None))
+
+
+def changed_positions(parent_genome, genome):
+    """
+    Returns the positions at which the genome differs from the parent genome,
+    or None if the genomes do not share a layout.
+    """
+    if isinstance(genome, dict):
+        if not isinstance(parent_genome, dict) or set(genome) != set(parent_genome):
+            return None
+        positions = []
+        for key in genome:
+            if isinstance(genome[key], (list, tuple)):
+                changed = changed_positions(parent_genome[key], genome[key])
+                if changed is None:
+                    return None
+                positions.extend((key, i) for i in changed)
+            elif genome[key] != parent_genome[key]:
+                positions.append(key)
+        return positions
+    if isinstance(parent_genome, dict) or len(genome) != len(parent_genome):
+        return None
+
+    return [i for i, (parent_gene, gene) in enumerate(zip(parent_genome, genome)) if parent_gene != gene]
+
+
+def evaluate_from_parent(solution, parent=None, positions=None):
+    """
+    Evaluates the solution, through evaluate_delta when the solution class
+    supports it and an evaluated parent is given.
+
+    Parameters:
+        solution: Class
+            Solution to evaluate.
+        parent: Class
+            Evaluated solution the solution was derived from, or None.
+        positions: list
+            Positions changed from the parent. Found by comparing the genomes
+            if not given.
+    """
+    if parent is not None and supports_delta(solution):
+        if positions is None:
+            positions = changed_positions(parent.genome, solution.genome)
+        if positions is not None:
+            solution.evaluate_delta(parent, positions)
+            return solution
+
+    solution.evaluate()
+    return solution
+
+
+def evaluate_child_function(solution):
+    """
+    Pool function evaluating a genetic algorithm child. Children produced
+    by mutation alone carry their parent in delta_parent and are evaluated
+    from it; the reference is dropped afterwards so parents do not chain
+    across generations.
+    """
+    parent = getattr(solution, 'delta_parent', None)
+    if parent is None:
+        return evaluate_function(solution)
+    solution.delta_parent = None
+
+    return evaluate_from_parent(solution, parent)
+
+
+def release_delta_parents(solution_list):
+    """
+    Drops the parent references of solutions that were not evaluated by
+    evaluate_child_function, e.g. children replayed from the journal.
+    """
+    for solution in solution_list:
+        if getattr(solution, 'delta_parent', None) is not None:
+            solution.delta_parent = None
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+
+"""
+This file contains the evaluation journal, an append-only record of every
+completed evaluation. Each line of the journal is a JSON object holding the
+solution name, genome and objective values. Lines are written as soon as an
+evaluation finishes and synced to disk in batches, so a run that is killed
+mid-generation loses at most the last batch. On restart the solvers replay
+the journal and only submit the evaluations that are still missing.
+"""
+
+JOURNAL_FILE = 'evaluation_journal.jsonl'
+
+
+def genome_key(genome):
+    """
+    Returns a hashable key identifying the genome.
+    """
+    return json.dumps(genome, sort_keys=True, default=str)
+
+
+def journal_entry(solution):
+    """
+    Returns the journal entry of an evaluated solution.
+    """
+    values = {}
+    for param in solution.parameters:
+        if 'value' in solution.parameters[param]:
+            values[param] = solution.parameters[param]['value']
+
+    return {'name': solution.name,
+            'genome': solution.genome,
+            'values': values}
+
+
+def replay_entry(solution, entry):
+    """
+    Fills in the objective values of the solution from a journal entry, in
+    place of evaluating it.
+    """
+    for param in entry['values']:
+        if param in solution.parameters:
+            solution.parameters[param]['value'] = entry['values'][param]
+
+    return solution
+
+
+def _evaluate_indexed(arguments):
+    """
+    Evaluates a solution in a pool worker and returns it with its index.
+    """
+    function, index, solution = arguments
+    return index, function(solution)
+
+
+def journaled_map(pool, function, solution_list, journal):
+    """
+    Evaluates the solutions on the pool, journaling each one as it completes.
+
+    Solutions journaled by the interrupted run the journal was reopened from
+    are replayed instead of submitted, see Evaluation_Journal.lookup. The
+    evaluated solutions are returned in the order given.
+
+    Parameters:
+        pool: Pool
+            Pool used for the evaluations.
+        function: function
+            Function that evaluates a solution and returns it.
+        solution_list: list
+            Solutions to evaluate.
+        journal: Class
+            Evaluation_Journal of the optimization.
+    """
+    evaluated = [None]*len(solution_list)
+    tasks = []
+    for i, solution in enumerate(solution_list):
+        entry = journal.lookup(solution)
+        if entry:
+            evaluated[i] = replay_entry(solution, entry)
+        else:
+            tasks.append((function, i, solution))
+
+    for i, solution in pool.imap_unordered(_evaluate_indexed, tasks):
+        journal.record(solution)
+        evaluated[i] = solution
+    journal.sync()
+
+    return evaluated
+
+
+class Evaluation_Journal(object):
+    """
+    Append-only journal of completed evaluations.
+
+    Parameters:
+        file_name: str
+            Path of the journal.
+        mode: str
+            'w' starts a new journal, 'a' replays and extends an existing one.
+        sync_every: int
+            Number of entries written between syncs to disk.
+        sync_interval: float
+            Maximum number of seconds between syncs to disk.
+    """
+    def __init__(self, file_name=JOURNAL_FILE, mode='a', sync_every=16, sync_interval=30.):
+        self.file_name = file_name
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.entries = {}
+        self.names = {}
+        self.loaded = {}  # Entries read from the existing journal, by name.
+        self.unsynced = 0
+        self.last_sync = time.time()
+        if mode == 'a' and os.path.isfile(file_name):
+            self._load()
+        self.file = open(file_name, mode)
+        if self.file.tell() > 0:
+            # terminates a line cut short by an interruption
+            with open(file_name, 'rb') as ifile:
+                ifile.seek(-1, os.SEEK_END)
+                if ifile.read(1) != b'\n':
+                    self.file.write('\n')
+
+    def _load(self):
+        """
+        Reads the entries already in the journal. A line cut short by an
+        interruption is ignored.
+        """
+        with open(self.file_name) as ifile:
+            for line in ifile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.entries[genome_key(entry['genome'])] = entry
+                self.names[entry['name']] = entry
+                self.loaded[entry['name']] = entry
+
+    def lookup(self, solution):
+        """
+        Returns the entry an interrupted run journaled for the solution, or
+        None. Only entries read from the journal when it was reopened are
+        replayed, and only for a solution with the same name and genome, so
+        every solution of the current run is evaluated.
+        """
+        entry = self.loaded.get(solution.name)
+        if entry is not None and genome_key(entry['genome']) == genome_key(solution.genome):
+            return entry
+        return None
+
+    def record(self, solution):
+        """
+        Journals an evaluated solution.
+        """
+        self.append(journal_entry(solution))
+
+    def append(self, entry):
+        """
+        Writes a journal entry, syncing to disk once enough have accumulated.
+        """
+        self.file.write(json.dumps(entry, default=str) + '\n')
+        self.entries[genome_key(entry['genome'])] = entry
+        self.names[entry['name']] = entry
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.time() - self.last_sync > self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """
+        Forces the written entries to disk.
+        """
+        if self.unsynced:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+        self.last_sync = time.time()
+
+    def close(self):
+        """
+        Syncs the journal and closes the file.
+        """
+        self.sync()
+        self.file.close()
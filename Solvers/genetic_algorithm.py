@@ -4,8 +4,6 @@ import sys
 import copy
 import math
 import time
-import h5py
-import yaml
 import numpy
 import pickle
 import shutil
@@ -15,6 +13,14 @@ from multiprocessing import Pool
 from midas.utils import fitness
 from midas.utils.solution_types import evaluate_function,Unique_Solution_Analyzer,test_evaluate_function
 from midas.utils.metrics import Optimization_Metric_Toolbox
+from .result_store import Result_Store
+from .evaluation_journal import Evaluation_Journal, journaled_map
+from .genome_map import read_genome_map
+from .worker_runtime import runtime_from_settings, solver_pool, pool_layout, Throughput_Meter
+from .solution_registry import Solution_Registry
+from .solution_archive import cleanup_action
+from .delta_evaluation import supports_delta, evaluate_child_function, release_delta_parents
+from .checkpoint import capture_rng_state, restore_rng_state, write_checkpoint, read_checkpoint
 
 """
 This file is for storing all the classes and methods specifically related to
@@ -355,6 +361,7 @@ class Reproduction(object):
     def __init__(self, mutation, settings=None):
         self.mutation = mutation
         self.mutation_list = None
+        self.mutation_parents = None
         self.crossover_list = None
 
     def select_reproduction_method(self, solution_list):
@@ -363,11 +370,13 @@ class Reproduction(object):
         undergo mutation.
         """
         self.mutation_list  = []
+        self.mutation_parents = []
         self.crossover_list = []
         for solution in solution_list:
 
             if random.random() < self.mutation.rate:
                 self.mutation_list.append(solution.genome)
+                self.mutation_parents.append(solution)
             else:
                 self.crossover_list.append(solution.genome)
 
@@ -453,15 +462,20 @@ class Reproduction(object):
             child_one, child_two = self.crossover(mate_one, mate_two, self.mutation.rate)
             child_genome_list.extend([child_one, child_two])
 
-        for genome in self.mutation_list:
+        child_parent_list = [None]*len(child_genome_list)
+        for genome, parent in zip(self.mutation_list, self.mutation_parents):
             child = self.mutation.reproduce(genome)
             child_genome_list.append(child)
+            child_parent_list.append(parent)
 
         new_solution_list = []
-        for child in child_genome_list:
+        for child, parent in zip(child_genome_list, child_parent_list):
 
             foo = solution_class()
             foo.genome = child
+            if parent is not None and supports_delta(foo):
+                # mutation only children are evaluated from their parent
+                foo.delta_parent = parent
 
             new_solution_list.append(foo)
 
@@ -514,11 +528,13 @@ class Dictionary_Genome_Reproducer(Reproduction):
         Class for choosing which solutions undergo crossover and mutation.
         """
         self.mutation_list  = []
+        self.mutation_parents = []
         self.crossover_list = []
         for solution in solution_list:
 
             if random.random() < self.mutation.rate:
                 self.mutation_list.append(solution)
+                self.mutation_parents.append(solution)
             else:
                 self.crossover_list.append(solution)
 
@@ -572,14 +588,19 @@ class Dictionary_Genome_Reproducer(Reproduction):
                                                                 self.mutation.rate)
             child_genome_list.extend([child_one, child_two])
 
+        child_parent_list = [None]*len(child_genome_list)
         for solution in self.mutation_list:
             child = self.mutation.reproduce(solution)
             child_genome_list.append(child)
+            child_parent_list.append(solution)
 
         new_solution_list = []
-        for child in child_genome_list:
+        for child, parent in zip(child_genome_list, child_parent_list):
             foo = solution_class()
             foo.genome = child
+            if parent is not None and supports_delta(foo):
+                # mutation only children are evaluated from their parent
+                foo.delta_parent = parent
             new_solution_list.append(foo)
 
         return new_solution_list
@@ -1048,19 +1069,24 @@ class Mcycle_Reproducer(Reproduction):
                 child_two = child_two + ci_child_two
             child_genome_list.extend([child_one, child_two])
 
-        for genome in self.mutation_list:
+        child_parent_list = [None]*len(child_genome_list)
+        for genome, parent in zip(self.mutation_list, self.mutation_parents):
             child = []
             for i in range(self.ncycles):
                 cigenome = genome[start_cycle_id[i]:end_cycle_id[i]]
                 cichild = self.mutation.reproduce(cigenome)
                 child = child + cichild
             child_genome_list.append(child)
+            child_parent_list.append(parent)
 
         new_solution_list = []
-        for child in child_genome_list:
+        for child, parent in zip(child_genome_list, child_parent_list):
 
             foo = solution_class()
             foo.genome = child
+            if parent is not None and supports_delta(foo):
+                # mutation only children are evaluated from their parent
+                foo.delta_parent = parent
 
             new_solution_list.append(foo)
 
@@ -1098,15 +1124,7 @@ class Mutation(object):
 
         WRitten by Brian Andersen. 1/21/2020.
         """
-        if not settings:
-            pass
-        else:
-            chrom_settings = settings['genome']['chromosomes']
-            for chrom in chrom_settings:
-                if chrom == "symmetry_list":
-                    self.symmetry_list = chrom_settings[chrom]
-                else:
-                    self.genome_map[chrom] = copy.deepcopy(chrom_settings[chrom]['map'])
+        self.genome_map, self.symmetry_list = read_genome_map(settings)
 
     def calculate_rate_increase(self, number_generations):
         """
@@ -1561,10 +1579,22 @@ class Genetic_Algorithm(object):
                 self.perform_cleanup = False
         else:
             self.perform_cleanup = False
+        self.registry = Solution_Registry(cleanup_action(file_settings['optimization'].get('cleanup')))  # Solution directories not yet cleaned up.
+        self.checkpoint_file = 'ga_checkpoint.pkl'
+        self.checkpoint_frequency = 1 #Generations between checkpoints.
+        if 'checkpoint' in file_settings['optimization']:
+            if 'file' in file_settings['optimization']['checkpoint']:
+                self.checkpoint_file = file_settings['optimization']['checkpoint']['file']
+            if 'frequency' in file_settings['optimization']['checkpoint']:
+                self.checkpoint_frequency = int(file_settings['optimization']['checkpoint']['frequency'])
+        self.runtime = runtime_from_settings(file_settings)  # Thread and core layout of the pool workers.
         
         if 'neural_network' in file_settings:
             from crudworks import CRUD_Predictor
             self.crud = CRUD_Predictor(file_settings)
+        if self.runtime is not None:
+            # after the predictor has loaded its backend, so its threads are limited
+            self.runtime.apply_master()
 
     def generate_initial_solutions(self,name):
         """
@@ -1602,9 +1632,8 @@ class Genetic_Algorithm(object):
         loading_pattern_tracker = open("loading_patterns.txt", 'w')
         loading_pattern_tracker.close()
 
-        all_value_count = 0
-        all_values = open('all_value_tracker.txt','w')
-        all_values.close()
+        all_values = Result_Store(mode='w')
+        journal = Evaluation_Journal(mode='w')
         for i in range(self.population.size):
             foo = self.generate_initial_solutions(f'initial_parent_{i}')
             self.population.parents.append(foo)
@@ -1613,31 +1642,13 @@ class Genetic_Algorithm(object):
             foo = self.generate_initial_solutions(f'initial_child_{i}')
             self.population.children.append(foo)
 
-        pool = Pool(processes=self.num_procs)
-        self.population.parents = pool.map(evaluate_function, self.population.parents)
+        pool = solver_pool(self.runtime, self.num_procs)
+        meter = Throughput_Meter(pool_layout(self.runtime, self.num_procs))
+        self.population.parents = journaled_map(pool, evaluate_function, self.population.parents, journal)
         print('finished parents...')
-        self.population.children = pool.map(evaluate_function, self.population.children)
+        self.population.children = journaled_map(pool, evaluate_function, self.population.children, journal)
         print('finished children...')
-        all_values = open('all_value_tracker.txt','a')
-        for sol in self.population.parents:
-            #print(sol.name)
-            if not all_value_count:
-                for param in sol.parameters:
-                    all_values.write(f"{param},    ")
-                all_values.write('\n')
-            all_values.write(f"{all_value_count},    {sol.name},    ")
-            for param in sol.parameters:
-                all_values.write(f"{sol.parameters[param]['value']},    ")
-                #print(f"{sol.parameters[param]['value']},    ")
-            all_values.write('\n')
-            all_value_count += 1
-        for sol in self.population.children:
-            all_values.write(f"{all_value_count},    {sol.name},")
-            for param in sol.parameters:
-                all_values.write(f"{sol.parameters[param]['value']},    ")
-            all_values.write('\n')
-            all_value_count += 1        
-        all_values.close()
+        evaluated = self.population.parents + self.population.children
 
 
         #self.population.parents = pool.map(self.crud.evaluator,self.population.parents)
@@ -1645,9 +1656,12 @@ class Genetic_Algorithm(object):
         # save all param before selection perform
         opt.record_all_param(self.population,self.generation, flag=True)
         self.population = self.selection.perform(self.population)
+        all_values.record_all(evaluated, generation=-1)
+        self.registry.register(evaluated)
         opt.check_best_worst_average(self.population.parents)
         
         opt.write_track_file(self.population, self.generation)
+        self.write_checkpoint(all_values, -1)
 
 #        scrambler = Fixed_Genome_Mutator(1,1,200,self.file_settings)
 #        uniqueness = Unique_Solution_Analyzer(scrambler)
@@ -1661,31 +1675,31 @@ class Genetic_Algorithm(object):
                 solution.add_additional_information(self.file_settings)
 
 
-            self.population.children = pool.map(evaluate_function, self.population.children)
+            meter.start()
+            self.population.children = journaled_map(pool, evaluate_child_function, self.population.children, journal)
+            meter.stop(len(self.population.children))
+            release_delta_parents(self.population.children)
             print('finished children...')
-            all_values = open('all_value_tracker.txt','a')
-            for sol in self.population.children:
-                all_values.write(f"{all_value_count},   {sol.name},   ")
-                #print(sol.name)
-                for param in sol.parameters:
-                    #print(f"{sol.parameters[param]['value']},    ")
-                    all_values.write(f"{sol.parameters[param]['value']},    ")
-                all_values.write('\n')
-                all_value_count += 1
-            all_values.close()
+            evaluated = self.population.children
             opt.record_all_param(self.population,self.generation, flag=False)
 
             #self.population.children = pool.map(self.crud.evaluator,self.population.children)
             self.cleanup()
             self.population = self.selection.perform(self.population)
+            all_values.record_all(evaluated, generation=self.generation.current)
             opt.check_best_worst_average(self.population.parents)
             opt.write_track_file(self.population, self.generation)
             opt.record_optimized_solutions(self.population)
+            if (self.generation.current + 1) % self.checkpoint_frequency == 0:
+                self.write_checkpoint(all_values, self.generation.current)
 
+        meter.report()
         track_file = open('optimization_track_file.txt','a')
         track_file.write("End of Optimization \n")
         track_file.close()
+        self.registry.stop()
         all_values.close()
+        journal.close()
         opt.plotter()
 
     def main_in_serial(self):
@@ -1733,7 +1747,7 @@ class Genetic_Algorithm(object):
                 solution.name = "child_{}_{}".format(self.generation.current, i)
                 solution.parameters = copy.deepcopy(self.file_settings['optimization']['objectives'])
                 solution.add_additional_information(self.file_settings)
-                solution.evaluate()
+                evaluate_child_function(solution)
 
            # self.population.children = map(evaluate_function, self.population.children)
 
@@ -1749,59 +1763,69 @@ class Genetic_Algorithm(object):
 
         opt.plotter()
 
+    def write_checkpoint(self, all_values, generation):
+        """
+        Writes a binary checkpoint of the optimization state after the given
+        generation. The population, generation counter, mutation rate schedule
+        and random number generator states are saved so a restart continues
+        exactly as the original run would have.
+
+        Parameters:
+            all_values: Class
+                Result store of the optimization. Flushed so the checkpoint
+                knows how many records belong to it.
+            generation: int
+                Last completed generation, -1 for the initial population.
+        """
+        all_values.flush()
+        mutation = self.repodroduction.mutation
+        state = {'parents': self.population.parents,
+                 'children': self.population.children,
+                 'solution_front': self.population.solution_front,
+                 'generation': generation,
+                 'mutation_rate': mutation.rate,
+                 'mutation_rate_increase': mutation.rate_incease,
+                 'all_value_count': all_values.count,
+                 'rng_state': capture_rng_state()}
+        write_checkpoint(self.checkpoint_file, 'Genetic_Algorithm', generation, state)
+
+    def load_checkpoint(self, all_values):
+        """
+        Restores the optimization state from the binary checkpoint. Records in
+        the result store written after the checkpoint are discarded, since
+        those generations are repeated.
+
+        Returns the first generation that still needs to be performed.
+        """
+        metadata, state = read_checkpoint(self.checkpoint_file, 'Genetic_Algorithm')
+        self.population.parents = state['parents']
+        self.population.children = state['children']
+        self.population.solution_front = state['solution_front']
+        self.repodroduction.mutation.rate = state['mutation_rate']
+        self.repodroduction.mutation.rate_incease = state['mutation_rate_increase']
+        all_values.truncate(state['all_value_count'])
+        restore_rng_state(state['rng_state'])
+
+        return state['generation'] + 1
+
     def cleanup(self):
         """
         Deletes solution results that are no longer relevant to the optimization.
 
+        The current parents and children are registered, and every other
+        registered directory is released to the registry's background thread,
+        so the cost is proportional to the population rather than to the
+        number of solutions evaluated so far.
+
         Written by Brian Andersen 10/28/2020.
         """
         gc.collect()
+        self.registry.register(self.population.parents + self.population.children)
         if self.perform_cleanup:
             if self.generation.current <= self.number_generations_post_cleanup:
                 pass
             else:
-                for cl in range(self.population.size+20):
-                    file_name = f'initial_parent_{cl}'
-                    if os.path.isdir(file_name):
-                        delete_file = True
-                        for parent,child in zip(self.population.parents,self.population.children):
-                            if parent.name == file_name:
-                                delete_file = False
-                                break
-                            elif child.name == file_name:
-                                delete_file = False
-                                break
-                        if delete_file:
-                            if os.path.isfile(f"{file_name}/{file_name}_sim.out"):
-                                os.remove(f"{file_name}/{file_name}_sim.out")
-                    file_name = f'initial_child_{cl}'
-                    if os.path.isdir(file_name):
-                        delete_file = True
-                        for parent,child in zip(self.population.parents,self.population.children):
-                            if parent.name == file_name:
-                                delete_file = False
-                                break
-                            elif child.name == file_name:
-                                delete_file = False
-                                break
-                        if delete_file:
-                            if os.path.isfile(f"{file_name}/{file_name}_sim.out"):
-                                os.remove(f"{file_name}/{file_name}_sim.out")
-                for clgen in range(self.generation.current):
-                    for clpop in range(self.population.size+20):
-                        file_name = f"child_{clgen}_{clpop}"
-                        if os.path.isdir(file_name):
-                            delete_file = True
-                            for parent,child in zip(self.population.parents,self.population.children):
-                                if parent.name == file_name:
-                                    delete_file = False
-                                    break
-                                elif child.name == file_name:
-                                    delete_file = False
-                                    break
-                            if delete_file:
-                                if os.path.isfile(f"{file_name}/{file_name}_sim.out"):
-                                    os.remove(f"{file_name}/{file_name}_sim.out")
+                self.registry.release(self.population.parents + self.population.children)
 
     def evaluate_neural_networks(self,eval_pop):
         """
@@ -1906,9 +1930,7 @@ class Genetic_Algorithm(object):
         loading_pattern_tracker = open("loading_patterns.txt", 'w')
         loading_pattern_tracker.close()
 
-        all_value_count = 0
-        all_values = open('all_value_tracker.txt','w')
-        all_values.close()
+        all_values = Result_Store(mode='w')
         for i in range(self.population.size):
             foo = self.solution()
             foo.name = "initial_parent_{}".format(i)
@@ -1936,29 +1958,10 @@ class Genetic_Algorithm(object):
                 foo.generate_initial(self.file_settings['genome']['chromosomes'])
             self.population.children.append(foo)
 
-        pool = Pool(processes=self.num_procs)
+        pool = solver_pool(self.runtime, self.num_procs)
         self.population.parents = pool.map(test_evaluate_function, self.population.parents)
         self.population.children = pool.map(test_evaluate_function, self.population.children)
-        all_values = open('all_value_tracker.txt','a')
-        for sol in self.population.parents:
-            #print(sol.name)
-            if not all_value_count:
-                for param in sol.parameters:
-                    all_values.write(f"{param},    ")
-                all_values.write('\n')
-            all_values.write(f"{all_value_count},    {sol.genome}    ")
-            for param in sol.parameters:
-                all_values.write(f"{sol.parameters[param]['value']},    ")
-                print(f"{sol.parameters[param]['value']},    ")
-            all_values.write('\n')
-            all_value_count += 1
-        for sol in self.population.children:
-            all_values.write(f"{all_value_count},   {sol.genome}   ")
-            for param in sol.parameters:
-                all_values.write(f"{sol.parameters[param]['value']},    ")
-            all_values.write('\n')
-            all_value_count += 1        
-        all_values.close()
+        all_values.record_all(self.population.parents + self.population.children, generation=-1)
 
 
         #self.population.parents = pool.map(self.crud.evaluator,self.population.parents)
@@ -1980,16 +1983,7 @@ class Genetic_Algorithm(object):
 
 
             self.population.children = pool.map(test_evaluate_function, self.population.children)
-            all_values = open('all_value_tracker.txt','a')
-            for sol in self.population.children:
-                all_values.write(f"{all_value_count},    {sol.genome}    ")
-                print(sol.name)
-                for param in sol.parameters:
-                    print(f"{sol.parameters[param]['value']},    ")
-                    all_values.write(f"{sol.parameters[param]['value']},    ")
-                all_values.write('\n')
-                all_value_count += 1
-            all_values.close()
+            all_values.record_all(self.population.children, generation=self.generation.current)
             #self.population.children = pool.map(self.crud.evaluator,self.population.children)
             self.cleanup()
             self.population = self.selection.perform(self.population)
@@ -2001,6 +1995,7 @@ class Genetic_Algorithm(object):
         track_file = open('optimization_track_file.txt','a')
         track_file.write("End of Optimization \n")
         track_file.close()
+        self.registry.stop()
         all_values.close()
         opt.plotter()
 
@@ -2098,68 +2093,79 @@ class Genetic_Algorithm(object):
         track_file.write("Restarting Optimization \n")
         track_file.close()
 
-        all_value_count = 0
-        all_values = open('all_value_tracker.txt','a')
-        all_values.write("Restarting\n")
-        all_values.close()
-        with open('optimized_solutions.yaml') as current_solutions:
-            solutions = yaml.safe_load(current_solutions)
-
-        track_file = open('optimization_track_file.txt','r')
-        track_lines = track_file.readlines()
-        track_file.close()
-
-        for line in track_lines:
-            if "Current generation of the optimization" in line:
-                elems = line.strip().split()
-                current_gen = int(elems[-1]) + 1
-        track_lines = None
+        all_values = Result_Store(mode='a')
+        journal = Evaluation_Journal(mode='a') #Replays evaluations finished before the interruption.
+        if os.path.isfile(self.checkpoint_file):
+            # resumes exactly where the checkpointed generation left off
+            current_gen = self.load_checkpoint(all_values)
+            uniqueness = None
+        else:
+            import yaml
+            with open('optimized_solutions.yaml') as current_solutions:
+                solutions = yaml.safe_load(current_solutions)
+
+            track_file = open('optimization_track_file.txt','r')
+            track_lines = track_file.readlines()
+            track_file.close()
+
+            for line in track_lines:
+                if "Current generation of the optimization" in line:
+                    elems = line.strip().split()
+                    current_gen = int(elems[-1]) + 1
+            track_lines = None
+
+            for solut in solutions:
+                foo = self.solution()
+                foo.name = solut
+                foo.genome = solutions[solut]['genome']
+                foo.parameters = solutions[solut]['parameters']
+                foo.fitness = float(solutions[solut]['fitness'])
+                self.population.parents.append(foo)
 
-        for solut in solutions:
-            foo = self.solution()
-            foo.name = solut
-            foo.genome = solutions[solut]['genome']
-            foo.parameters = solutions[solut]['parameters']
-            foo.fitness = float(solutions[solut]['fitness'])
-            self.population.parents.append(foo)
+            scrambler = Fixed_Genome_Mutator(1,1,200,self.file_settings)
+            uniqueness = Unique_Solution_Analyzer(scrambler)
 
-        pool = Pool(processes=self.num_procs)
+        pool = solver_pool(self.runtime, self.num_procs)
+        meter = Throughput_Meter(pool_layout(self.runtime, self.num_procs))
 
         #self.population.parents = pool.map(self.crud.evaluator,self.population.parents)
         #self.population.children = pool.map(self.crud.evaluator,self.population.children)
         
-        scrambler = Fixed_Genome_Mutator(1,1,200,self.file_settings)
-        uniqueness = Unique_Solution_Analyzer(scrambler)
         for self.generation.current in range(current_gen,self.generation.total):
             self.population.children = self.repodroduction.reproduce(self.population.parents, 
                                                                      self.solution)
-            self.population.children = uniqueness.analyze(self.population.children)
+            if uniqueness:
+                self.population.children = uniqueness.analyze(self.population.children)
             for i,solution in enumerate(self.population.children):
                 solution.name = "child_{}_{}".format(self.generation.current, i)
                 solution.parameters = copy.deepcopy(self.file_settings['optimization']['objectives'])
                 solution.add_additional_information(self.file_settings)
 
 
-            self.population.children = pool.map(evaluate_function, self.population.children)
-            all_values = open('all_value_tracker.txt','a')
+            meter.start()
+            self.population.children = journaled_map(pool, evaluate_child_function, self.population.children, journal)
+            meter.stop(len(self.population.children))
+            release_delta_parents(self.population.children)
             for sol in self.population.children:
-                all_values.write(f"{all_value_count},   {sol.name},   ")
                 print(sol.name)
                 for param in sol.parameters:
                     print(f"{sol.parameters[param]['value']},    ")
-                    all_values.write(f"{sol.parameters[param]['value']},    ")
-                all_values.write('\n')
-                all_value_count += 1
-            all_values.close()
+            evaluated = self.population.children
             #self.population.children = pool.map(self.crud.evaluator,self.population.children)
             self.cleanup()
             self.population = self.selection.perform(self.population)
+            all_values.record_all(evaluated, generation=self.generation.current)
             opt.check_best_worst_average(self.population.parents)
             opt.write_track_file(self.population, self.generation)
             opt.record_optimized_solutions(self.population)
+            if (self.generation.current + 1) % self.checkpoint_frequency == 0:
+                self.write_checkpoint(all_values, self.generation.current)
 
+        meter.report()
         track_file = open('optimization_track_file.txt','a')
         track_file.write("End of Optimization \n")
         track_file.close()
+        self.registry.stop()
         all_values.close()
+        journal.close()
         opt.plotter()
@@ -0,0 +1,30 @@
+import copy
+
+"""
+This file contains the reading of the genome maps of the chromosome settings.
+The map of a gene marks with a 1 every genome position the gene may be placed
+at. The genetic algorithm mutates and crosses over within the maps, and the
+reinforcement learning environments mask infeasible placements with them.
+"""
+
+
+def read_genome_map(settings):
+    """
+    Returns the genome map of every chromosome in the settings, and the
+    symmetry list of the genome.
+
+    Parameters:
+        settings: Dictionary
+            The input yaml file, as a dictionary.
+    """
+    genome_map = {}
+    symmetry_list = []
+    if settings:
+        chrom_settings = settings['genome']['chromosomes']
+        for chrom in chrom_settings:
+            if chrom == "symmetry_list":
+                symmetry_list = chrom_settings[chrom]
+            else:
+                genome_map[chrom] = copy.deepcopy(chrom_settings[chrom]['map'])
+
+    return genome_map, symmetry_list
@@ -0,0 +1,229 @@
+import queue
+import threading
+import multiprocessing
+from .result_store import Result_Store, solution_record
+from .evaluation_journal import Evaluation_Journal, journal_entry
+
+"""
+This file contains the log shipping used when several processes report to the
+same output files. Rather than every worker opening, appending to and closing
+all_value_tracker.h5, optimization_track_file.txt or trackfile.txt, workers
+push their records onto a queue and a single writer thread in the master
+process batches them to disk.
+"""
+
+
+class Log_Client(object):
+    """
+    Handle used by workers to ship log records to the master process.
+
+    The client only holds the queue proxy, so it can be pickled and passed
+    to pool workers or vectorized environments. Without a queue the client
+    writes directly to disk, which keeps single process use unchanged.
+
+    Parameters:
+        log_queue: Queue
+            Queue drained by a Log_Shipper. None writes directly.
+    """
+    def __init__(self, log_queue=None):
+        self.queue = log_queue
+        self.store = None
+        self.evaluation_journal = None
+
+    def write(self, file_name, text):
+        """
+        Appends the text to the file.
+        """
+        if self.queue is None:
+            with open(file_name, 'a') as ofile:
+                ofile.write(text)
+        else:
+            self.queue.put(('text', file_name, text))
+
+    def record(self, solution, generation=-1, worker=-1, fitness=None, genome=None):
+        """
+        Adds the evaluated solution to the master's result store.
+        """
+        record = solution_record(solution, generation, worker, fitness, genome=genome)
+        if self.queue is None:
+            if self.store is None:
+                self.store = Result_Store(mode='a')
+            self.store.append(record)
+        else:
+            self.queue.put(('record', None, record))
+
+    def journal(self, solution):
+        """
+        Adds the evaluated solution to the master's evaluation journal.
+        """
+        entry = journal_entry(solution)
+        if self.queue is None:
+            if self.evaluation_journal is None:
+                self.evaluation_journal = Evaluation_Journal(mode='a')
+            self.evaluation_journal.append(entry)
+        else:
+            self.queue.put(('journal', None, entry))
+
+    def close(self):
+        """
+        Flushes records held by a client writing directly to disk.
+        """
+        if self.store is not None:
+            self.store.close()
+        if self.evaluation_journal is not None:
+            self.evaluation_journal.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['store'] = None
+        state['evaluation_journal'] = None
+        return state
+
+
+class Log_Shipper(object):
+    """
+    Single writer for log records shipped by worker processes.
+
+    Records are pulled off a managed queue by a thread in the master process
+    and written in batches of up to batch_size records, or whatever has
+    arrived after flush_interval seconds. Text files are kept open for the
+    life of the shipper and flushed once per batch.
+
+    Parameters:
+        store: Class
+            Result_Store that receives shipped solution records.
+        journal: Class
+            Evaluation_Journal that receives shipped journal entries.
+        ctx: multiprocessing context
+            Context used to create the queue manager. Must match the context
+            of the pools the clients are passed to.
+        batch_size: int
+            Maximum number of records written per batch.
+        flush_interval: float
+            Seconds to wait for records before writing a partial batch.
+    """
+    def __init__(self, store=None, ctx=None, batch_size=256, flush_interval=1.0, journal=None):
+        if ctx is None:
+            ctx = multiprocessing
+        self.store = store
+        self.journal = journal
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.manager = ctx.Manager()
+        self.queue = self.manager.Queue()
+        self.files = {}
+        self.error = None  # First error raised while writing.
+        self.synced = threading.Event()
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def client(self):
+        """
+        Returns a client that ships records to this writer.
+        """
+        return Log_Client(self.queue)
+
+    def _write(self):
+        """
+        Drains the queue until the stop sentinel is received.
+        """
+        running = True
+        while running:
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            except (EOFError, OSError) as error:
+                # the manager holding the queue is gone
+                if self.error is None:
+                    self.error = error
+                running = False
+
+            for item in batch:
+                if item is None:
+                    running = False
+                    continue
+                kind, file_name, payload = item
+                try:
+                    if kind == 'sync':
+                        self._flush()
+                    elif kind == 'text':
+                        if file_name not in self.files:
+                            self.files[file_name] = open(file_name, 'a')
+                        self.files[file_name].write(payload)
+                    elif kind == 'record':
+                        self.store.append(payload)
+                    elif kind == 'journal':
+                        self.journal.append(payload)
+                except Exception as error:
+                    # kept for sync and stop to raise, the writer keeps draining
+                    if self.error is None:
+                        self.error = error
+                finally:
+                    if kind == 'sync':
+                        self.synced.set()
+            try:
+                for ofile in self.files.values():
+                    ofile.flush()
+            except Exception as error:
+                if self.error is None:
+                    self.error = error
+        # wakes a sync waiting on a writer that stopped
+        self.synced.set()
+
+    def _flush(self):
+        """
+        Writes everything the writer holds in memory to disk.
+        """
+        for ofile in self.files.values():
+            ofile.flush()
+        if self.store is not None:
+            self.store.flush()
+        if self.journal is not None:
+            self.journal.sync()
+
+    def _raise_error(self):
+        """
+        Raises the first error the writer hit, so failed writes are not lost
+        silently.
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError(f"Log shipper failed to write records: {error!r}") from error
+
+    def sync(self):
+        """
+        Blocks until every record shipped so far is on disk. Raises a
+        RuntimeError if the writer failed to write any of them.
+        """
+        self.synced.clear()
+        if self.thread.is_alive():
+            self.queue.put(('sync', None, None))
+            while not self.synced.wait(self.flush_interval):
+                if not self.thread.is_alive():
+                    self.error = self.error or RuntimeError("Log shipper writer thread stopped.")
+                    break
+        self._raise_error()
+
+    def stop(self):
+        """
+        Writes every record still in the queue and shuts the writer down.
+        Raises a RuntimeError if the writer failed to write any record.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        try:
+            for ofile in self.files.values():
+                ofile.close()
+            self.files = {}
+            if self.store is not None:
+                self.store.close()
+            if self.journal is not None:
+                self.journal.close()
+        finally:
+            self.manager.shutdown()
+        self._raise_error()
@@ -4,16 +4,16 @@ import sys
 import copy
 import math
 import time
-import h5py
-import yaml
 import numpy
-import pickle
 import shutil
 import random
 from multiprocessing import Pool
 from midas.utils import fitness
 from midas.utils.solution_types import evaluate_function,Unique_Solution_Analyzer,test_evaluate_function
 from midas.utils.metrics import Optimization_Metric_Toolbox
+from .result_store import Result_Store
+from .evaluation_journal import Evaluation_Journal, journaled_map
+from .worker_runtime import runtime_from_settings, solver_pool, pool_layout, Throughput_Meter
 
 """
 This file is for storing all the classes and methods specifically related to
@@ -53,6 +53,7 @@ class Random_Solution(object):
         self.fitness = fitness
         self.num_procs = num_procs
         self.file_settings = file_settings
+        self.runtime = runtime_from_settings(file_settings)  # Thread and core layout of the pool workers.
        
 
     def generate_initial_solutions(self,name):
@@ -73,59 +74,74 @@ class Random_Solution(object):
 
         return foo
 
-    def main_in_parallel(self):
+    def main_in_parallel(self, restart=False):
         """
         Performs optimization using a genetic algorithm in with
         parallel computations
 
-        Parameters: None
+        Parameters:
+            restart: bool
+                Replays the evaluation journal of an interrupted run, so only
+                the solutions that were never evaluated are submitted.
 
         Written by Brian Andersen. 1/9/2020
         """
         opt = Optimization_Metric_Toolbox()
 
-        track_file = open('optimization_track_file.txt', 'w')
-        track_file.write("Beginning Optimization \n")
-        track_file.close()
+        if restart:
+            track_file = open('optimization_track_file.txt', 'a')
+            track_file.write("Restarting Optimization \n")
+            track_file.close()
+            journal = Evaluation_Journal(mode='a')
+        else:
+            track_file = open('optimization_track_file.txt', 'w')
+            track_file.write("Beginning Optimization \n")
+            track_file.close()
 
-        loading_pattern_tracker = open("loading_patterns.txt", 'w')
-        loading_pattern_tracker.close()
+            loading_pattern_tracker = open("loading_patterns.txt", 'w')
+            loading_pattern_tracker.close()
+            journal = Evaluation_Journal(mode='w')
 
-        all_value_count = 0
-        all_values = open('all_value_tracker.txt','w')
-        all_values.close()
+        all_values = Result_Store(mode='w')
         for i in range(self.population.size):
-            foo = self.generate_initial_solutions(f'solution_{i}')
+            name = f'solution_{i}'
+            if name in journal.names:
+                foo = self.solution()
+                foo.name = name
+                foo.parameters = copy.deepcopy(self.file_settings['optimization']['objectives'])
+                foo.add_additional_information(self.file_settings)
+                foo.genome = journal.names[name]['genome']
+            else:
+                foo = self.generate_initial_solutions(name)
             self.population.parents.append(foo)
 
-        pool = Pool(processes=self.num_procs)
-        self.population.parents = pool.map(evaluate_function, self.population.parents)
+        pool = solver_pool(self.runtime, self.num_procs)
+        meter = Throughput_Meter(pool_layout(self.runtime, self.num_procs))
+        meter.start()
+        self.population.parents = journaled_map(pool, evaluate_function, self.population.parents, journal)
+        meter.stop(len(self.population.parents))
         print('finished solutions...')
-        all_values = open('all_value_tracker.txt','a')
         for sol in self.population.parents:
-            #print(sol.name)
-            if not all_value_count:
-                for param in sol.parameters:
-                    all_values.write(f"{param},    ")
-                all_values.write(f"Fitness,    ")
-                all_values.write('\n')
-            all_values.write(f"{all_value_count},    {sol.name},    ")
-            for param in sol.parameters:
-                all_values.write(f"{sol.parameters[param]['value']},    ")
-                #print(f"{sol.parameters[param]['value']},    ")
             solList = self.fitness.calculate([sol])
-            all_values.write(f"{solList[0].fitness},    ")
-            all_values.write('\n')
-            all_value_count += 1
+            all_values.record(sol, fitness=solList[0].fitness)
 
 
         #self.population.parents = pool.map(self.crud.evaluator,self.population.parents)
         #self.population.children = pool.map(self.crud.evaluator,self.population.children)
         # save all param before selection perform
+        meter.report()
         track_file = open('optimization_track_file.txt','a')
         track_file.write("End of Optimization \n")
         track_file.close()
         all_values.close()
+        journal.close()
+
+    def restart_main_in_parallel(self):
+        """
+        Continues an interrupted random solution generation from the
+        evaluation journal.
+        """
+        self.main_in_parallel(restart=True)
 
     def main_in_serial(self):
         """
@@ -4,22 +4,296 @@ import time
 import numpy as np
 import pickle
 import random
-import matplotlib.pyplot as plt
 import shutil
 import copy
 from pathlib import Path
 import gym
 from gym import spaces
 import yaml
-from fileinput import filename
-import gym
-from stable_baselines3.common.vec_env import DummyVecEnv
-from stable_baselines3.common.monitor import Monitor
-from stable_baselines3.common.env_util import make_vec_env
-from stable_baselines3 import SAC, PPO, A2C, DQN
-import torch as th
 from midas.utils import fitness
 from midas.utils.metrics import Optimization_Metric_Toolbox
+from .result_store import Result_Store
+from .checkpoint import capture_rng_state, restore_rng_state, write_checkpoint, read_checkpoint
+from .log_shipper import Log_Client, Log_Shipper
+from .delta_evaluation import supports_delta, changed_positions, evaluate_from_parent
+from .evaluation_journal import genome_key, journal_entry, replay_entry
+from .genome_map import read_genome_map
+from .worker_runtime import runtime_from_settings, pool_layout, Throughput_Meter
+from .replay_prefill import prefill_replay_buffer, load_replay_buffer, save_replay_buffer, replay_buffer_file
+
+
+def episode_state(solution):
+    """
+    Returns the fuel state of the core of a solution.
+    """
+    return {key: value['Value'] for key, value in solution.core_dict['fuel'].items()}
+
+
+def last_episode_parent(env, state):
+    """
+    Returns the solution evaluated at the end of the environment's previous
+    episode and the core locations changed since, or None and None if the
+    state cannot be evaluated from it.
+    """
+    if env.parent is not None:
+        positions = changed_positions(env.parent_state, state)
+        if positions is not None:
+            return env.parent, positions
+    return None, None
+
+
+def keep_last_episode(env, solution, state):
+    """
+    Keeps an evaluated solution as the parent of the environment's next
+    episode, when the solution class supports delta evaluation.
+    """
+    if supports_delta(solution):
+        env.parent = copy.deepcopy(solution)
+        env.parent_state = state
+
+
+def evaluate_from_last_episode(env):
+    """
+    Evaluates the solution at the end of an episode. When the solution class
+    supports delta evaluation, the environment keeps the solution evaluated at
+    the end of the previous episode and only the core locations changed since
+    are recomputed.
+    """
+    state = episode_state(env.solution)
+    parent, positions = last_episode_parent(env, state)
+    evaluate_from_parent(env.solution, parent, positions)
+    keep_last_episode(env, env.solution, state)
+
+class Reward_Cache(object):
+    """
+    Cache of the objective values of the terminal states of RL episodes.
+
+    Policies near convergence keep producing the same final loading pattern.
+    The cache is keyed by the fuel state of the core, so a repeated terminal
+    state is filled in from the cache rather than simulated again.
+
+    Parameters:
+        store: dict
+            Mapping holding the cache. A managed dictionary shares the cache
+            between environments running in separate processes; a plain
+            dictionary is used if None.
+    """
+    def __init__(self, store=None):
+        self.store = {} if store is None else store
+
+    @staticmethod
+    def key(solution):
+        """
+        Returns the key of the terminal state of the solution.
+        """
+        return genome_key({key: value['Value'] for key, value in solution.core_dict['fuel'].items()})
+
+    def lookup(self, solution):
+        """
+        Returns the cached journal entry for the state of the solution, or None.
+        """
+        return self.store.get(self.key(solution))
+
+    def add(self, solution):
+        """
+        Caches the objective values of an evaluated solution.
+        """
+        self.store[self.key(solution)] = journal_entry(solution)
+
+
+def action_feasibility(file_settings, inventory, positions):
+    """
+    Returns a boolean array with a row per step of an episode and a column
+    per inventory assembly, True where the assembly may be placed.
+
+    Feasibility is read from the chromosome maps of the settings, the same
+    maps the genetic algorithm mutates with.
+
+    Parameters:
+        file_settings: Dictionary
+            The settings file of the optimization.
+        inventory: list
+            Inventory assemblies, in the order of the discrete actions.
+        positions: list
+            Genome position filled by each step. None allows every assembly.
+    """
+    genome_map = read_genome_map(file_settings)[0]
+    masks = np.ones((len(positions), len(inventory)), dtype=bool)
+    for i, position in enumerate(positions):
+        if position is None:
+            continue
+        for j, assembly in enumerate(inventory):
+            if assembly in genome_map and position < len(genome_map[assembly]):
+                masks[i, j] = genome_map[assembly][position] == 1
+        if not masks[i].any():
+            # a step the maps leave without options is left unmasked
+            masks[i] = True
+
+    return masks
+
+
+class Observation_Buffer(object):
+    """
+    Preallocated observation of an RL environment, updated in place.
+
+    The map state is read from the solution once per episode, at reset. A
+    step only changes the assembly at one location and the step counter, so
+    only those entries are written. When the map state of the solution class
+    does not follow the order of its fuel locations, get_mapstate is called
+    on every step instead, still without allocating a new observation.
+
+    Parameters:
+        cmap: dict
+            Map of the inventory assemblies to their observation values.
+        observation_type: str
+            'continuous' or 'multi_discrete'.
+    """
+    def __init__(self, cmap, observation_type):
+        self.cmap = cmap
+        self.observation_type = observation_type
+        self.observation = None
+        self.index = None  # fuel location -> entry of the map state, None to read the whole map state
+        self.counter_index = 0
+
+    def _state(self):
+        """
+        Returns the view of the observation holding the map state.
+        """
+        if self.observation_type == "continuous":
+            return self.observation[0]
+        return self.observation
+
+    def _layout(self, solution, cstate):
+        """
+        Returns the entry of the map state of each fuel location, or None if
+        the map state does not follow the order of the fuel locations.
+        """
+        fuel = solution.core_dict['fuel']
+        values = [self.cmap.get(value['Value']) for value in fuel.values()]
+        if None in values or len(values) > cstate.shape[0]:
+            return None
+        if not np.allclose(np.asarray(values, dtype=float), cstate[:len(values)]):
+            return None
+        return {key: i for i, key in enumerate(fuel)}
+
+    def _set_counter(self, counter):
+        if self.observation_type == "continuous":
+            self.observation[1, self.counter_index] = 0
+            self.observation[1, counter] = 1
+            self.counter_index = counter
+        else:
+            self.observation[-1] = counter
+
+    def reset(self, solution, counter):
+        """
+        Fills the observation from the map state of the solution.
+        """
+        cstate = solution.get_mapstate(self.cmap, self.observation_type)
+        if self.observation is None:
+            if self.observation_type == "continuous":
+                self.observation = np.zeros((2, cstate.shape[0]))
+            else:
+                self.observation = np.empty_like(cstate)
+            self.index = self._layout(solution, cstate)
+        self._state()[:] = cstate
+        self._set_counter(counter)
+        return self.observation
+
+    def update(self, solution, location, counter):
+        """
+        Writes the assembly placed at the location and the step counter.
+        """
+        if self.index is not None and location in self.index:
+            self._state()[self.index[location]] = self.cmap[solution.core_dict['fuel'][location]['Value']]
+        else:
+            self._state()[:] = solution.get_mapstate(self.cmap, self.observation_type)
+        self._set_counter(counter)
+        return self.observation
+
+
+class Restart_State(object):
+    """
+    Core state episodes restart from, kept in memory.
+
+    The state of the best solution is only rebuilt when the best solution
+    changes, and written to state_file every flush_frequency resets rather
+    than on every reset. A flush_frequency of 0 only writes it on flush.
+
+    Parameters:
+        state_file: str
+            File the restart state is written to.
+        flush_frequency: int
+            Number of resets between writes of the restart state.
+    """
+    def __init__(self, state_file='state1.yml', flush_frequency=1):
+        self.state_file = state_file
+        self.flush_frequency = flush_frequency
+        self.solution = None
+        self.state = None
+        self.resets = 0
+        self.flushed = True
+
+    def update(self, best_solution):
+        """
+        Returns the state of the best solution, writing it out when due.
+        """
+        if best_solution is not self.solution:
+            self.solution = best_solution
+            self.state = {key: value['Value'] for key, value in best_solution.core_dict['fuel'].items()}
+            self.flushed = False
+        self.resets += 1
+        if self.flush_frequency and self.resets % self.flush_frequency == 0:
+            self.flush()
+        return self.state
+
+    def flush(self):
+        """
+        Writes the restart state if it changed since it was last written.
+        """
+        if self.flushed or self.state is None:
+            return
+        with open(self.state_file, 'w') as outfile:
+            yaml.dump(self.state, outfile, default_flow_style=False)
+        self.flushed = True
+
+
+def make_env(env_class, rank, env_kwargs, monitor_file=None, info_keywords=(), working_directory=None,
+             override_existing=True, runtime=None):
+    """
+    Returns a function that builds one environment of a vectorized environment.
+
+    Parameters:
+        env_class: Class
+            Gym environment to build.
+        rank: int
+            Index of the environment, used to give its solutions unique names.
+        env_kwargs: dict
+            Keyword arguments of the environment.
+        monitor_file: str
+            Path of the Monitor output of the environment.
+        info_keywords: tuple
+            Entries of the info dictionary written by the Monitor.
+        working_directory: str
+            Directory the environment evaluates its solutions in. Only valid
+            when each environment runs in its own process.
+        override_existing: bool
+            False appends to an existing Monitor output, when resuming.
+        runtime: Class
+            Worker_Runtime applied to the environment's process. Only valid
+            when each environment runs in its own process.
+    """
+    def _init():
+        from stable_baselines3.common.monitor import Monitor
+        if runtime is not None:
+            runtime.apply(rank)
+        env = env_class(rank=rank, **env_kwargs)
+        if working_directory is not None:
+            os.makedirs(working_directory, exist_ok=True)
+            os.chdir(working_directory)
+        return Monitor(env, monitor_file, info_keywords=info_keywords, override_existing=override_existing)
+
+    return _init
+
 
 class Cycle1_Gym_Env(gym.Env):
     """
@@ -30,7 +304,7 @@ class Cycle1_Gym_Env(gym.Env):
     metadata = {'render.modes': ['console']}
     # Define constants for clearer code
 
-    def __init__(self,solution,file_settings,fitness):
+    def __init__(self,solution,file_settings,fitness,log=None,rank=None,reward_cache=None,reward_model=None):
         super(Cycle1_Gym_Env, self).__init__()
         self.solution = solution
         self.best_solution = solution
@@ -73,6 +347,10 @@ class Cycle1_Gym_Env(gym.Env):
                 self.cmap[invent[i]]=cmap_range[i]
             self.action_space = spaces.Box(low=-1, high=1,
                                             shape=(1,), dtype=np.float32)
+        # assemblies the chromosome maps allow at the location of each step
+        genome_position = {loc: i for i, loc in enumerate(self.start)}
+        self.masks = action_feasibility(file_settings, invent,
+                                        [genome_position.get(loc) for loc in self.order])
         
         if self.observation_type=='multi_discrete':
             self.observation_space = spaces.MultiDiscrete([nass,nass,nass,nass,nass,nass,
@@ -86,8 +364,23 @@ class Cycle1_Gym_Env(gym.Env):
         
 
         self.trackfile='trackfile.txt'
-        with open(self.trackfile, "w") as ofile:
-            ofile.write('PWR core optimization with MOF')
+        if log is None:
+            # standalone environment, otherwise the solver owns the track file
+            with open(self.trackfile, "w") as ofile:
+                ofile.write('PWR core optimization with MOF')
+            log = Log_Client()
+        self.log = log
+        self.parent = None  # Last evaluated solution, kept for delta evaluation.
+        self.parent_state = None
+        self.rank = rank  # Index of the environment in a vectorized environment.
+        self.prefetched = None  # Solution of the final step, evaluated ahead of the step.
+        self.reward_cache = reward_cache  # Objective values of terminal states already evaluated.
+        self.cache_hits = 0
+        self.reward_model = reward_model  # Surrogate scoring episodes in place of simulations.
+        self.imagined = None  # Objective values of the final step, predicted ahead of the step.
+        self.observation = Observation_Buffer(self.cmap, self.observation_type)
+        sb3_options = file_settings['optimization']['stable_baselines3_options']
+        self.restart_state = Restart_State(flush_frequency=int(sb3_options.get('state_flush_frequency', 1)))
 
     def reset(self):
         """
@@ -96,28 +389,83 @@ class Cycle1_Gym_Env(gym.Env):
         """
         self.counter=0
         if self.restart:
-            new_state = {}
-            for key, value in self.best_solution.core_dict['fuel'].items():
-                new_state[key]=value['Value']
-            with open('state1.yml', 'w') as outfile:
-                yaml.dump(new_state, outfile, default_flow_style=False)
-            self.solution.set_state(new_state)
+            self.solution.set_state(self.restart_state.update(self.best_solution))
         else:
             self.solution.set_state(self.start)
         
-        if self.observation_type=="continuous":
-            cstate = self.solution.get_mapstate(self.cmap,self.observation_type)
-            loc_state = np.zeros(cstate.shape[0])
-            loc_state[self.counter]=1
-            rstate=np.r_[[cstate],[loc_state]]
-        elif self.observation_type=="multi_discrete":
-            cstate = self.solution.get_mapstate(self.cmap,self.observation_type)
-            cstate[-1] = self.counter
-            rstate=cstate
-        return(rstate)
+        return(self.observation.reset(self.solution, self.counter))
+
+    def action_masks(self):
+        """
+        Returns the inventory assemblies the chromosome maps allow at the
+        location of the next step, for maskable policies.
+        """
+        if self.counter < len(self.masks):
+            return self.masks[self.counter]
+        return np.ones(self.masks.shape[1], dtype=bool)
+
+    def step_location(self, counter):
+        """
+        Returns the core location filled by the given step of an episode.
+        """
+        return self.order[counter]
+
+    def imagine(self, solution):
+        """
+        Decides whether the reward model scores the completed solution in
+        place of a simulation, and returns the predicted objective values if
+        it does, otherwise None.
+        """
+        self.imagined = None
+        if self.reward_model is not None:
+            state = {key: value['Value'] for key, value in solution.core_dict['fuel'].items()}
+            self.imagined = self.reward_model.imagine(state)
+        return self.imagined
+
+    def checkpoint_state(self):
+        """
+        Returns the progress of the environment saved in training checkpoints.
+        """
+        return {'best_solution': self.best_solution,
+                'total_run': self.total_run,
+                'cache_hits': self.cache_hits,
+                'rng_state': capture_rng_state()}  # of the process the environment runs in
+
+    def restore_state(self, state):
+        """
+        Restores the progress saved by checkpoint_state.
+        """
+        self.best_solution = state['best_solution']
+        self.total_run = state['total_run']
+        self.cache_hits = state['cache_hits']
+        if 'rng_state' in state:
+            restore_rng_state(state['rng_state'])
+
+    def solution_name(self, run):
+        """
+        Returns the name of the solution evaluated in the given episode.
+        """
+        if self.rank is None:
+            return "solution_{}".format(run)
+        return "solution_{}_{}".format(self.rank, run)
+
+    def terminal_solution(self, action):
+        """
+        Returns a copy of the solution completed by the action, named as step
+        would name it, or None if the action does not end the episode.
+        """
+        if self.counter != len(self.start)-1:
+            return None
+        solution = copy.deepcopy(self.solution)
+        solution.mapaction({'Location': self.step_location(self.counter),
+                            'Value': action,
+                            'Space': self.action_type,
+                            'Action_Map': self.cmap})
+        solution.name = self.solution_name(self.total_run + 1)
+        return solution
 
     def step(self, action):
-        loc = self.order[self.counter]
+        loc = self.step_location(self.counter)
         act=self.solution.get_actions()
         sact={'Location': loc,
                 'Value': action,
@@ -128,8 +476,32 @@ class Cycle1_Gym_Env(gym.Env):
         if self.counter==len(self.start)-1:
             mid = 0
             self.total_run +=1
-            self.solution.name = "solution_{}".format(self.total_run)
-            self.solution.evaluate()
+            self.solution.name = self.solution_name(self.total_run)
+            entry = None
+            if self.reward_cache is not None:
+                entry = self.reward_cache.lookup(self.solution)
+            if entry is None and self.prefetched is None and self.imagined is None:
+                self.imagine(self.solution)
+            imagined = self.imagined
+            self.imagined = None
+            if entry is not None:
+                replay_entry(self.solution, entry)
+                self.cache_hits += 1
+            elif imagined is not None:
+                # scored by the reward model, the state is never simulated
+                replay_entry(self.solution, {'values': imagined})
+            elif self.prefetched is not None:
+                # evaluated ahead of the step by Batched_Evaluation_VecEnv
+                self.solution = self.prefetched
+            else:
+                evaluate_from_last_episode(self)
+            self.prefetched = None
+            if entry is None and imagined is None:
+                if self.reward_cache is not None:
+                    self.reward_cache.add(self.solution)
+                if self.reward_model is not None:
+                    self.reward_model.add({key: value['Value'] for key, value in self.solution.core_dict['fuel'].items()},
+                                          journal_entry(self.solution)['values'])
             solList = self.fitness.calculate([self.solution])
             self.solution=solList[0]
             if self.fitness_const:
@@ -140,18 +512,20 @@ class Cycle1_Gym_Env(gym.Env):
                   'FDeltaH':self.solution.parameters["FDeltaH"]['value'],
                   'PinPowerPeaking':self.solution.parameters["PinPowerPeaking"]['value'],
                   'State': self.solution.get_mapstate(self.cmap,self.observation_type)}
-            all_values = open('all_value_tracker.txt','a')
-            all_values.write(f"{self.total_run},   {self.solution.name},   ")
-            for param in self.solution.parameters:
-                all_values.write(f"{self.solution.parameters[param]['value']},    ")
-            all_values.write(f"{self.solution.fitness},    ")
-            all_values.write('\n')
-            all_values.close()
-            if self.total_run ==1:
-                self.best_solution=copy.deepcopy(self.solution)
-            else:
-                if self.best_solution.fitness<self.solution.fitness:
-                    self.best_solution = copy.deepcopy(self.solution)
+            if self.reward_cache is not None:
+                info['cache_hit_rate'] = self.cache_hits / self.total_run
+            if self.reward_model is not None:
+                info['imagined_rate'] = self.reward_model.imagined_rate()
+            if imagined is None:
+                # only simulated solutions are recorded or kept as the best
+                self.log.record(self.solution, generation=self.total_run,
+                                fitness=self.solution.fitness,
+                                genome=[value['Value'] for value in self.solution.core_dict['fuel'].values()])
+                if self.total_run ==1:
+                    self.best_solution=copy.deepcopy(self.solution)
+                else:
+                    if self.best_solution.fitness<self.solution.fitness:
+                        self.best_solution = copy.deepcopy(self.solution)
         else:
             mid = self.counter + 1
             reward=0
@@ -159,26 +533,21 @@ class Cycle1_Gym_Env(gym.Env):
         self.counter+=1
         done = bool(self.counter==len(self.order))
         
-        if self.observation_type=="continuous":
-            cstate = self.solution.get_mapstate(self.cmap,self.observation_type)
-            loc_state = np.zeros(cstate.shape[0])
-            loc_state[mid]=1
-            rstate=np.r_[[cstate],[loc_state]]
-        elif self.observation_type=="multi_discrete":
-            cstate = self.solution.get_mapstate(self.cmap,self.observation_type)
-            cstate[-1] = mid
-            rstate=cstate
+        rstate = self.observation.update(self.solution, loc, mid)
+        if done:
+            # the vectorized environment keeps the terminal observation past the reset
+            rstate = rstate.copy()
         return((rstate, reward, done, info))
     
     def render(self, mode='console'):
         if mode != 'console':
             mode='console'
-        with open(self.trackfile, 'a') as ofile:
-            ofile.write("\nStep {}".format(self.counter))
-            ofile.write('\n    obs=' + str(self.solution.get_mapstate()) +  '\n    reward=' + str(self.solution.fitness) + "\n")
+        self.log.write(self.trackfile, "\nStep {}".format(self.counter) +
+                       '\n    obs=' + str(self.solution.get_mapstate()) +  '\n    reward=' + str(self.solution.fitness) + "\n")
 
     def close(self):
-        pass
+        self.restart_state.flush()
+        self.log.close()
 
 class MCycle_Gym_Env(gym.Env):
     """
@@ -189,7 +558,7 @@ class MCycle_Gym_Env(gym.Env):
     metadata = {'render.modes': ['console']}
     # Define constants for clearer code
 
-    def __init__(self,solution,file_settings,fitness):
+    def __init__(self,solution,file_settings,fitness,log=None,rank=None,reward_cache=None,reward_model=None):
         super(MCycle_Gym_Env, self).__init__()
         self.solution = solution
         self.best_solution = solution
@@ -216,6 +585,7 @@ class MCycle_Gym_Env(gym.Env):
         self.maxcounter = len(self.order)
         with open(state0_file) as f:
             self.start = yaml.safe_load(f)
+        self.cycle_length = len(self.start['C1'])  # Steps filling the locations of each cycle.
 
         self.solution.set_state(self.start)
         self.action_type= file_settings['optimization']['stable_baselines3_options']['action_space']
@@ -233,6 +603,16 @@ class MCycle_Gym_Env(gym.Env):
                 self.cmap[invent[i]]=cmap_range[i]
             self.action_space = spaces.Box(low=-1, high=1,
                                             shape=(1,), dtype=np.float32)
+        # assemblies the chromosome maps allow at the location of each step,
+        # the genome holding the locations of each cycle in turn
+        genome_position = {loc: i for i, loc in enumerate(self.start['C1'])}
+        positions = []
+        for counter, loc in enumerate(self.order):
+            position = genome_position.get(loc)
+            if position is not None:
+                position += (counter//self.cycle_length)*self.cycle_length
+            positions.append(position)
+        self.masks = action_feasibility(file_settings, invent, positions)
         
         if self.observation_type=='multi_discrete':
             self.observation_space = spaces.MultiDiscrete([nass,nass,nass,nass,nass,nass,
@@ -246,8 +626,23 @@ class MCycle_Gym_Env(gym.Env):
         
 
         self.trackfile='trackfile.txt'
-        with open(self.trackfile, "w") as ofile:
-            ofile.write('PWR core optimization with MOF')
+        if log is None:
+            # standalone environment, otherwise the solver owns the track file
+            with open(self.trackfile, "w") as ofile:
+                ofile.write('PWR core optimization with MOF')
+            log = Log_Client()
+        self.log = log
+        self.parent = None  # Last evaluated solution, kept for delta evaluation.
+        self.parent_state = None
+        self.rank = rank  # Index of the environment in a vectorized environment.
+        self.prefetched = None  # Solution of the final step, evaluated ahead of the step.
+        self.reward_cache = reward_cache  # Objective values of terminal states already evaluated.
+        self.cache_hits = 0
+        self.reward_model = reward_model  # Surrogate scoring episodes in place of simulations.
+        self.imagined = None  # Objective values of the final step, predicted ahead of the step.
+        self.observation = Observation_Buffer(self.cmap, self.observation_type)
+        sb3_options = file_settings['optimization']['stable_baselines3_options']
+        self.restart_state = Restart_State(flush_frequency=int(sb3_options.get('state_flush_frequency', 1)))
 
     def reset(self):
         """
@@ -256,30 +651,83 @@ class MCycle_Gym_Env(gym.Env):
         """
         self.counter=0
         if self.restart:
-            new_state = {}
-            for key, value in self.best_solution.core_dict['fuel'].items():
-                new_state[key]=value['Value']
-            with open('state1.yml', 'w') as outfile:
-                yaml.dump(new_state, outfile, default_flow_style=False)
-            self.solution.set_state(new_state)
+            self.solution.set_state(self.restart_state.update(self.best_solution))
         else:
             self.solution.set_state(self.start)
         
-        if self.observation_type=="continuous":
-            cstate = self.solution.get_mapstate(self.cmap,self.observation_type)
-            loc_state = np.zeros(cstate.shape[0])
-            loc_state[self.counter]=1
-            rstate=np.r_[[cstate],[loc_state]]
-        elif self.observation_type=="multi_discrete":
-            cstate = self.solution.get_mapstate(self.cmap,self.observation_type)
-            cstate[-1] = self.counter
-            rstate=cstate
-        return(rstate)
+        return(self.observation.reset(self.solution, self.counter))
+
+    def action_masks(self):
+        """
+        Returns the inventory assemblies the chromosome maps allow at the
+        location of the next step, for maskable policies.
+        """
+        if self.counter < len(self.masks):
+            return self.masks[self.counter]
+        return np.ones(self.masks.shape[1], dtype=bool)
+
+    def step_location(self, counter):
+        """
+        Returns the core location filled by the given step of an episode.
+        """
+        return (counter//self.cycle_length + 1, self.order[counter])
+
+    def imagine(self, solution):
+        """
+        Decides whether the reward model scores the completed solution in
+        place of a simulation, and returns the predicted objective values if
+        it does, otherwise None.
+        """
+        self.imagined = None
+        if self.reward_model is not None:
+            state = {key: value['Value'] for key, value in solution.core_dict['fuel'].items()}
+            self.imagined = self.reward_model.imagine(state)
+        return self.imagined
+
+    def checkpoint_state(self):
+        """
+        Returns the progress of the environment saved in training checkpoints.
+        """
+        return {'best_solution': self.best_solution,
+                'total_run': self.total_run,
+                'cache_hits': self.cache_hits,
+                'rng_state': capture_rng_state()}  # of the process the environment runs in
+
+    def restore_state(self, state):
+        """
+        Restores the progress saved by checkpoint_state.
+        """
+        self.best_solution = state['best_solution']
+        self.total_run = state['total_run']
+        self.cache_hits = state['cache_hits']
+        if 'rng_state' in state:
+            restore_rng_state(state['rng_state'])
+
+    def solution_name(self, run):
+        """
+        Returns the name of the solution evaluated in the given episode.
+        """
+        if self.rank is None:
+            return "solution_{}".format(run)
+        return "solution_{}_{}".format(self.rank, run)
+
+    def terminal_solution(self, action):
+        """
+        Returns a copy of the solution completed by the action, named as step
+        would name it, or None if the action does not end the episode.
+        """
+        if self.counter != len(self.start['C1'])*3-1:
+            return None
+        solution = copy.deepcopy(self.solution)
+        solution.mapaction({'Location': self.step_location(self.counter),
+                            'Value': action,
+                            'Space': self.action_type,
+                            'Action_Map': self.cmap})
+        solution.name = self.solution_name(self.total_run + 1)
+        return solution
 
     def step(self, action):
-        loc = self.order[self.counter]
-        lcycle = int((self.counter)/56)+1
-        sact={  'Location': (lcycle, loc),
+        sact={  'Location': self.step_location(self.counter),
                 'Value': action,
                 'Space':self.action_type,
                 'Action_Map':self.cmap}
@@ -288,8 +736,32 @@ class MCycle_Gym_Env(gym.Env):
         if self.counter==len(self.start['C1'])*3-1:
             mid = 0
             self.total_run +=1
-            self.solution.name = "solution_{}".format(self.total_run)
-            self.solution.evaluate()
+            self.solution.name = self.solution_name(self.total_run)
+            entry = None
+            if self.reward_cache is not None:
+                entry = self.reward_cache.lookup(self.solution)
+            if entry is None and self.prefetched is None and self.imagined is None:
+                self.imagine(self.solution)
+            imagined = self.imagined
+            self.imagined = None
+            if entry is not None:
+                replay_entry(self.solution, entry)
+                self.cache_hits += 1
+            elif imagined is not None:
+                # scored by the reward model, the state is never simulated
+                replay_entry(self.solution, {'values': imagined})
+            elif self.prefetched is not None:
+                # evaluated ahead of the step by Batched_Evaluation_VecEnv
+                self.solution = self.prefetched
+            else:
+                evaluate_from_last_episode(self)
+            self.prefetched = None
+            if entry is None and imagined is None:
+                if self.reward_cache is not None:
+                    self.reward_cache.add(self.solution)
+                if self.reward_model is not None:
+                    self.reward_model.add({key: value['Value'] for key, value in self.solution.core_dict['fuel'].items()},
+                                          journal_entry(self.solution)['values'])
             solList = self.fitness.calculate([self.solution])
             self.solution=solList[0]
             if self.fitness_const:
@@ -303,18 +775,20 @@ class MCycle_Gym_Env(gym.Env):
                   'PinPowerPeaking':self.solution.parameters["PinPowerPeaking"]['value'],
                   'lcoe':self.solution.parameters["lcoe"]['value'],
                   'State': self.solution.get_mapstate(self.cmap,self.observation_type)}
-            all_values = open('all_value_tracker.txt','a')
-            all_values.write(f"{self.total_run},   {self.solution.name},   ")
-            for param in self.solution.parameters:
-                all_values.write(f"{self.solution.parameters[param]['value']},    ")
-            all_values.write(f"{self.solution.fitness},    ")
-            all_values.write('\n')
-            all_values.close()
-            if self.total_run ==1:
-                self.best_solution=copy.deepcopy(self.solution)
-            else:
-                if self.best_solution.fitness<self.solution.fitness:
-                    self.best_solution = copy.deepcopy(self.solution)
+            if self.reward_cache is not None:
+                info['cache_hit_rate'] = self.cache_hits / self.total_run
+            if self.reward_model is not None:
+                info['imagined_rate'] = self.reward_model.imagined_rate()
+            if imagined is None:
+                # only simulated solutions are recorded or kept as the best
+                self.log.record(self.solution, generation=self.total_run,
+                                fitness=self.solution.fitness,
+                                genome=[value['Value'] for value in self.solution.core_dict['fuel'].values()])
+                if self.total_run ==1:
+                    self.best_solution=copy.deepcopy(self.solution)
+                else:
+                    if self.best_solution.fitness<self.solution.fitness:
+                        self.best_solution = copy.deepcopy(self.solution)
         else:
             mid = self.counter + 1
             reward=0
@@ -322,26 +796,21 @@ class MCycle_Gym_Env(gym.Env):
         self.counter+=1
         done = bool(self.counter==len(self.order))
         
-        if self.observation_type=="continuous":
-            cstate = self.solution.get_mapstate(self.cmap,self.observation_type)
-            loc_state = np.zeros(cstate.shape[0])
-            loc_state[mid]=1
-            rstate=np.r_[[cstate],[loc_state]]
-        elif self.observation_type=="multi_discrete":
-            cstate = self.solution.get_mapstate(self.cmap,self.observation_type)
-            cstate[-1] = mid
-            rstate=cstate
+        rstate = self.observation.update(self.solution, sact['Location'], mid)
+        if done:
+            # the vectorized environment keeps the terminal observation past the reset
+            rstate = rstate.copy()
         return((rstate, reward, done, info))
     
     def render(self, mode='console'):
         if mode != 'console':
             mode='console'
-        with open(self.trackfile, 'a') as ofile:
-            ofile.write("\nStep {}".format(self.counter))
-            ofile.write('\n    obs=' + str(self.solution.get_mapstate()) +  '\n    reward=' + str(self.solution.fitness) + "\n")
+        self.log.write(self.trackfile, "\nStep {}".format(self.counter) +
+                       '\n    obs=' + str(self.solution.get_mapstate()) +  '\n    reward=' + str(self.solution.fitness) + "\n")
 
     def close(self):
-        pass
+        self.restart_state.flush()
+        self.log.close()
 
 
 class Reinforcement_Learning(object):
@@ -377,7 +846,96 @@ class Reinforcement_Learning(object):
         self.fitness= fitness
         self.num_procs = num_procs
         self.file_settings = file_settings
+        self.runtime = runtime_from_settings(file_settings)  # Thread and core layout of the environment processes.
+        self.checkpoint_file = 'rl_checkpoint.pkl'
+        self.reward_cache = None  # Reward_Cache of the environments, saved in checkpoints.
+        self.reward_model = None  # Reward_Model the environments share, saved in checkpoints.
+        self.checkpoint_frequency = 0  # Episodes between checkpoints, none if 0.
+        if 'checkpoint' in file_settings['optimization']:
+            self.checkpoint_frequency = 100
+            if 'file' in file_settings['optimization']['checkpoint']:
+                self.checkpoint_file = file_settings['optimization']['checkpoint']['file']
+            if 'frequency' in file_settings['optimization']['checkpoint']:
+                self.checkpoint_frequency = int(file_settings['optimization']['checkpoint']['frequency'])
+
+
+    def build_reward_model(self, solution, manager=None):
+        """
+        Returns the surrogate reward model set by the reward_model entry of
+        the stable_baselines3_options. Given a Reward_Model_Manager, the model
+        is served by the manager and a proxy to it is returned.
+        """
+        from .reward_model import Reward_Model
+        model_settings = self.file_settings['optimization']['stable_baselines3_options']['reward_model']
+        if not isinstance(model_settings, dict):
+            model_settings = {}
+        model_class = Reward_Model if manager is None else manager.Reward_Model
 
+        return model_class(None, list(solution.core_dict['Inventory'].keys()),
+                           list(self.file_settings['optimization']['objectives'].keys()),
+                           real_fraction=float(model_settings.get('real_fraction', 0.1)),
+                           uncertainty=float(model_settings.get('uncertainty', 0.25)),
+                           min_samples=int(model_settings.get('min_samples', 50)),
+                           regularization=float(model_settings.get('regularization', 1.0)),
+                           refit_interval=int(model_settings.get('refit_interval', 16)))
+
+    def checkpoint_files(self):
+        """
+        Returns the files the checkpointed model and replay buffer are kept in.
+        """
+        model_file = f"{os.path.splitext(self.checkpoint_file)[0]}_model.zip"
+        return model_file, replay_buffer_file(model_file[:-len('.zip')])
+
+    def write_checkpoint(self, model, env, shipper, all_values):
+        """
+        Writes a checkpoint of the training. The model is saved with its
+        policy and optimizer states, off-policy models with their replay
+        buffer. The best solution, number of runs and random number
+        generator states of every environment, the reward cache and the
+        random number generator states of this process, torch included, are
+        saved in the checkpoint file. The checkpoint file is replaced last,
+        and every file is written to a temporary file first, so an
+        interruption while writing never leaves a file half written.
+        """
+        model_file, buffer_file = self.checkpoint_files()
+        model.save(f"{model_file}.tmp")
+        os.replace(f"{model_file}.tmp", model_file)
+        if getattr(model, 'replay_buffer', None) is not None:
+            model.save_replay_buffer(f"{buffer_file}.tmp")
+            os.replace(f"{buffer_file}.tmp", buffer_file)
+        shipper.sync()
+        state = {'num_timesteps': model.num_timesteps,
+                 'envs': env.env_method('checkpoint_state'),
+                 'all_value_count': all_values.count,
+                 'reward_cache': None if self.reward_cache is None else dict(self.reward_cache.store),
+                 'reward_model': None if self.reward_model is None else self.reward_model.checkpoint(),
+                 'rng_state': capture_rng_state()}
+        write_checkpoint(self.checkpoint_file, 'Reinforcement_Learning', model.num_timesteps, state)
+
+    def load_checkpoint(self, model, env, all_values):
+        """
+        Restores the model, its replay buffer and the progress of the
+        environments from the checkpoint, and returns the number of time steps
+        trained before it. Records in the result store written after the
+        checkpoint are discarded.
+        """
+        metadata, state = read_checkpoint(self.checkpoint_file, 'Reinforcement_Learning')
+        model_file, buffer_file = self.checkpoint_files()
+        model.set_parameters(model_file)
+        if getattr(model, 'replay_buffer', None) is not None and os.path.isfile(buffer_file):
+            model.load_replay_buffer(buffer_file)
+        model.num_timesteps = state['num_timesteps']
+        for i, env_state in enumerate(state['envs'][:env.num_envs]):
+            env.env_method('restore_state', env_state, indices=i)
+        if self.reward_cache is not None and state.get('reward_cache'):
+            # the cache hits restored with the environments count hits on these entries
+            self.reward_cache.store.update(state['reward_cache'])
+        if self.reward_model is not None and state.get('reward_model') is not None:
+            self.reward_model.restore(state['reward_model'])
+        all_values.truncate(state['all_value_count'])
+        restore_rng_state(state['rng_state'])
+
+        return state['num_timesteps']
 
     def main_in_serial(self):
         """
@@ -389,18 +947,37 @@ class Reinforcement_Learning(object):
 
         Written by Brian Andersen 1/9/2020
         """
+        # stable_baselines3 and torch are only loaded by runs that train
+        from stable_baselines3 import SAC, PPO, A2C, DQN
+        from stable_baselines3.common.vec_env import DummyVecEnv
+        from stable_baselines3.common.monitor import Monitor
+        from .rl_training import Checkpoint_Callback
+        if self.runtime is not None:
+            self.runtime.apply_master()
         opt = Optimization_Metric_Toolbox()
 
-        track_file = open('optimization_track_file.txt', 'w')
-        track_file.write("Beginning Optimization \n")
-        track_file.close()
+        # resumes the training from the last checkpoint when asked to and one exists
+        resume = bool(self.file_settings['optimization']['stable_baselines3_options'].get('resume', False)
+                      and os.path.isfile(self.checkpoint_file))
+        if resume:
+            track_file = open('optimization_track_file.txt', 'a')
+            track_file.write("Resuming Optimization \n")
+            track_file.close()
+        else:
+            track_file = open('optimization_track_file.txt', 'w')
+            track_file.write("Beginning Optimization \n")
+            track_file.close()
 
-        all_values = open('all_value_tracker.txt','w')
-        all_values.close()
+        all_values = Result_Store(mode='a' if resume else 'w')
+        shipper = Log_Shipper(all_values)
+        log = shipper.client()
+        if not resume:
+            with open('trackfile.txt', "w") as ofile:
+                ofile.write('PWR core optimization with MOF')
 
 
-        loading_pattern_tracker = open("loading patterns.txt", 'w')
-        loading_pattern_tracker.close()
+            loading_pattern_tracker = open("loading patterns.txt", 'w')
+            loading_pattern_tracker.close()
 
         log_dir = self.file_settings['optimization']['stable_baselines3_options']['logdir']
         os.makedirs(log_dir, exist_ok=True)
@@ -415,7 +992,18 @@ class Reinforcement_Learning(object):
         foo.parameters = copy.deepcopy(self.file_settings['optimization']['objectives'])
         foo.add_additional_information(self.file_settings)
         Custom_Env = globals()[self.file_settings['optimization']['environment']]
-        env = Monitor(Custom_Env(foo,self.file_settings,self.fitness),log_dir,info_keywords=info_kwd)
+        reward_cache = None
+        if self.file_settings['optimization']['stable_baselines3_options'].get('reward_cache', False):
+            reward_cache = Reward_Cache()
+            info_kwd = info_kwd + ('cache_hit_rate',)
+        self.reward_cache = reward_cache
+        reward_model = None
+        if 'reward_model' in self.file_settings['optimization']['stable_baselines3_options']:
+            reward_model = self.build_reward_model(foo)
+            info_kwd = info_kwd + ('imagined_rate',)
+        self.reward_model = reward_model
+        env = Monitor(Custom_Env(foo,self.file_settings,self.fitness,log=log,reward_cache=reward_cache,reward_model=reward_model),log_dir,info_keywords=info_kwd,
+                      override_existing=not resume)
         env = DummyVecEnv([lambda: env])
         net1 = self.file_settings['optimization']['stable_baselines3_options']['policy_net']
         net2 = self.file_settings['optimization']['stable_baselines3_options']['qvalue_net']
@@ -437,9 +1025,14 @@ class Reinforcement_Learning(object):
             train_freq=self.file_settings['optimization']['stable_baselines3_options']['train_freq'], 
             gradient_steps=self.file_settings['optimization']['stable_baselines3_options']['gradient_steps'],
             tensorboard_log=tens_log,policy_kwargs=policy_kwargs)
-        elif sb_algo == 'PPO':
+        elif sb_algo in ('PPO', 'MaskablePPO'):
+            ppo_class = PPO
+            if sb_algo == 'MaskablePPO':
+                # invalid placements are masked through the environments' action_masks
+                from sb3_contrib import MaskablePPO
+                ppo_class = MaskablePPO
             policy_kwargs = dict(net_arch=[dict(pi=net1, vf=net2)])
-            model=PPO('MlpPolicy', env, verbose=1, 
+            model=ppo_class('MlpPolicy', env, verbose=1, 
             learning_rate=self.file_settings['optimization']['stable_baselines3_options']['learning_rate'], 
             n_steps=self.file_settings['optimization']['stable_baselines3_options']['n_steps'], 
             batch_size=self.file_settings['optimization']['stable_baselines3_options']['batch_size'], 
@@ -473,16 +1066,42 @@ class Reinforcement_Learning(object):
                     learning_rate=self.file_settings['optimization']['stable_baselines3_options']['learning_rate'],
                     tensorboard_log=tens_log,policy_kwargs=policy_kwargs)
 
+        sb3_options = self.file_settings['optimization']['stable_baselines3_options']
         games_numbers = self.generation.total
         steps_per_game = len(self.file_settings['optimization']['order'])
-        model.learn(total_timesteps=steps_per_game*games_numbers)
+        completed_timesteps = 0
+        if resume:
+            # the checkpoint holds the replay buffer, nothing is loaded or prefilled
+            completed_timesteps = self.load_checkpoint(model, env, all_values)
+        else:
+            if sb3_options.get('save_replay_buffer', False):
+                # off-policy models carry their replay buffer over from the last run
+                load_replay_buffer(model, model_save)
+            if 'replay_prefill' in sb3_options:
+                prefill = sb3_options['replay_prefill']
+                added, skipped = prefill_replay_buffer(model, env.envs[0].unwrapped,
+                                                       prefill.get('results'), prefill.get('journals'),
+                                                       prefill.get('solutions'))
+                log.write('optimization_track_file.txt', f"Replay buffer prefilled with {added} historical episodes, "
+                          f"{skipped} patterns skipped as they do not fit the environment \n")
+
+        callback = None
+        if self.checkpoint_frequency:
+            callback = Checkpoint_Callback(lambda model, training_env: self.write_checkpoint(model, training_env, shipper, all_values),
+                                           self.checkpoint_frequency*steps_per_game)
+        meter = Throughput_Meter("1 environment in the master process")
+        meter.start()
+        model.learn(total_timesteps=max(steps_per_game*games_numbers - completed_timesteps, 0),
+                    callback=callback, reset_num_timesteps=not resume)
+        meter.stop((model.num_timesteps - completed_timesteps)//steps_per_game)
         model.save(model_save)
+        if sb3_options.get('save_replay_buffer', False):
+            save_replay_buffer(model, model_save)
         obs = env.reset()
-
-
-        track_file = open('optimization_track_file.txt','a')
-        track_file.write("End of Optimization \n")
-        track_file.close()
+        env.close()
+        log.write('optimization_track_file.txt', meter.summary())
+        log.write('optimization_track_file.txt', "End of Optimization \n")
+        shipper.stop()
 
         opt.plotter()
 
@@ -496,25 +1115,37 @@ class Reinforcement_Learning(object):
 
         Written by Brian Andersen 1/9/2020
         """
-        myEnv_id = 'mcycle/PARCS-v0' # It is best practice to have a space name and version number.
-        gym.envs.registration.register(
-            id=myEnv_id,
-            entry_point=MCycle_Gym_Env,
-            max_episode_steps=1000000, # Customize to your needs.
-            reward_threshold=10000 # Customize to your needs.
-        )
+        # stable_baselines3 and torch are only loaded by runs that train
+        from stable_baselines3 import SAC, PPO, A2C, DQN
+        from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
+        from .rl_training import Batched_Evaluation_VecEnv, Checkpoint_Callback
+        from .reward_model import Reward_Model_Manager
+        if self.runtime is not None:
+            self.runtime.apply_master()
         opt = Optimization_Metric_Toolbox()
 
-        track_file = open('optimization_track_file.txt', 'w')
-        track_file.write("Beginning Optimization \n")
-        track_file.close()
+        # resumes the training from the last checkpoint when asked to and one exists
+        resume = bool(self.file_settings['optimization']['stable_baselines3_options'].get('resume', False)
+                      and os.path.isfile(self.checkpoint_file))
+        if resume:
+            track_file = open('optimization_track_file.txt', 'a')
+            track_file.write("Resuming Optimization \n")
+            track_file.close()
+        else:
+            track_file = open('optimization_track_file.txt', 'w')
+            track_file.write("Beginning Optimization \n")
+            track_file.close()
 
-        all_values = open('all_value_tracker.txt','w')
-        all_values.close()
+        all_values = Result_Store(mode='a' if resume else 'w')
+        shipper = Log_Shipper(all_values)
+        log = shipper.client()
+        if not resume:
+            with open('trackfile.txt', "w") as ofile:
+                ofile.write('PWR core optimization with MOF')
 
 
-        loading_pattern_tracker = open("loading patterns.txt", 'w')
-        loading_pattern_tracker.close()
+            loading_pattern_tracker = open("loading patterns.txt", 'w')
+            loading_pattern_tracker.close()
 
         log_dir = self.file_settings['optimization']['stable_baselines3_options']['logdir']
         os.makedirs(log_dir, exist_ok=True)
@@ -528,7 +1159,48 @@ class Reinforcement_Learning(object):
         foo.name = "solution"
         foo.parameters = copy.deepcopy(self.file_settings['optimization']['objectives'])
         foo.add_additional_information(self.file_settings)
-        vec_env = make_vec_env(myEnv_id, n_envs=self.num_procs, env_kwargs={"solution": foo, "file_settings": self.file_settings, "fitness": self.fitness})
+        # 'dummy' steps every environment in this process, as before. With
+        # 'subproc' every environment steps and evaluates in its own process
+        # and working directory env_{rank}, so relative paths in the settings
+        # are resolved there, and 'batched' steps them in this one but
+        # evaluates the final solutions of their episodes together on a
+        # process pool
+        vec_env_type = self.file_settings['optimization']['stable_baselines3_options'].get('vec_env', 'dummy')
+        reward_cache = None
+        if self.file_settings['optimization']['stable_baselines3_options'].get('reward_cache', False):
+            # environments in other processes share the cache through the log manager
+            reward_cache = Reward_Cache(shipper.manager.dict() if vec_env_type == 'subproc' else None)
+            info_kwd = info_kwd + ('cache_hit_rate',)
+        self.reward_cache = reward_cache
+        reward_model = None
+        reward_model_manager = None
+        if 'reward_model' in self.file_settings['optimization']['stable_baselines3_options']:
+            if vec_env_type == 'subproc':
+                # environments in other processes learn one model served by a manager
+                reward_model_manager = Reward_Model_Manager()
+                reward_model_manager.start()
+            # environments in this process learn one model together
+            reward_model = self.build_reward_model(foo, reward_model_manager)
+            info_kwd = info_kwd + ('imagined_rate',)
+        self.reward_model = reward_model
+        env_fns = []
+        for rank in range(self.num_procs):
+            env_kwargs = {"solution": copy.deepcopy(foo), "file_settings": self.file_settings,
+                          "fitness": self.fitness, "log": log, "reward_cache": reward_cache,
+                          "reward_model": reward_model}
+            working_directory = None
+            if vec_env_type == 'subproc':
+                working_directory = os.path.abspath(f"env_{rank}")
+            env_fns.append(make_env(MCycle_Gym_Env, rank, env_kwargs,
+                                    os.path.join(os.path.abspath(log_dir), str(rank)),
+                                    info_kwd, working_directory, override_existing=not resume,
+                                    runtime=self.runtime if vec_env_type == 'subproc' else None))
+        if vec_env_type == 'subproc':
+            vec_env = SubprocVecEnv(env_fns)
+        elif vec_env_type == 'batched':
+            vec_env = Batched_Evaluation_VecEnv(env_fns, self.num_procs, self.runtime)
+        else:
+            vec_env = DummyVecEnv(env_fns)
         net1 = self.file_settings['optimization']['stable_baselines3_options']['policy_net']
         net2 = self.file_settings['optimization']['stable_baselines3_options']['qvalue_net']
         tens_log = self.file_settings['optimization']['stable_baselines3_options']['tensorboard_log']
@@ -549,9 +1221,14 @@ class Reinforcement_Learning(object):
             train_freq=self.file_settings['optimization']['stable_baselines3_options']['train_freq'], 
             gradient_steps=self.file_settings['optimization']['stable_baselines3_options']['gradient_steps'],
             tensorboard_log=tens_log,policy_kwargs=policy_kwargs)
-        elif sb_algo == 'PPO':
+        elif sb_algo in ('PPO', 'MaskablePPO'):
+            ppo_class = PPO
+            if sb_algo == 'MaskablePPO':
+                # invalid placements are masked through the environments' action_masks
+                from sb3_contrib import MaskablePPO
+                ppo_class = MaskablePPO
             policy_kwargs = dict(net_arch=[dict(pi=net1, vf=net2)])
-            model=PPO('MlpPolicy', vec_env, verbose=1, 
+            model=ppo_class('MlpPolicy', vec_env, verbose=1, 
             learning_rate=self.file_settings['optimization']['stable_baselines3_options']['learning_rate'], 
             n_steps=self.file_settings['optimization']['stable_baselines3_options']['n_steps'], 
             batch_size=self.file_settings['optimization']['stable_baselines3_options']['batch_size'], 
@@ -561,15 +1238,45 @@ class Reinforcement_Learning(object):
             clip_range=self.file_settings['optimization']['stable_baselines3_options']['clip_range'],
             tensorboard_log=tens_log,policy_kwargs=policy_kwargs)
 
+        sb3_options = self.file_settings['optimization']['stable_baselines3_options']
         games_numbers = self.generation.total
         steps_per_game = len(self.file_settings['optimization']['order'])
-        model.learn(total_timesteps=steps_per_game*games_numbers)
-        model.save(model_save)
-        obs = env.reset()
-
+        completed_timesteps = 0
+        if resume:
+            # the checkpoint holds the replay buffer, nothing is loaded or prefilled
+            completed_timesteps = self.load_checkpoint(model, vec_env, all_values)
+        else:
+            if sb3_options.get('save_replay_buffer', False):
+                # off-policy models carry their replay buffer over from the last run
+                load_replay_buffer(model, model_save)
+            if 'replay_prefill' in sb3_options:
+                prefill = sb3_options['replay_prefill']
+                added, skipped = prefill_replay_buffer(model, MCycle_Gym_Env(copy.deepcopy(foo), self.file_settings, self.fitness, log=log),
+                                                       prefill.get('results'), prefill.get('journals'),
+                                                       prefill.get('solutions'))
+                log.write('optimization_track_file.txt', f"Replay buffer prefilled with {added} historical episodes, "
+                          f"{skipped} patterns skipped as they do not fit the environment \n")
 
-        track_file = open('optimization_track_file.txt','a')
-        track_file.write("End of Optimization \n")
-        track_file.close()
+        callback = None
+        if self.checkpoint_frequency:
+            callback = Checkpoint_Callback(lambda model, training_env: self.write_checkpoint(model, training_env, shipper, all_values),
+                                           self.checkpoint_frequency*steps_per_game)
+        if vec_env_type in ('subproc', 'batched'):
+            meter = Throughput_Meter(pool_layout(self.runtime, self.num_procs))
+        else:
+            meter = Throughput_Meter(f"{self.num_procs} environments in the master process")
+        meter.start()
+        model.learn(total_timesteps=max(steps_per_game*games_numbers - completed_timesteps, 0),
+                    callback=callback, reset_num_timesteps=not resume)
+        meter.stop((model.num_timesteps - completed_timesteps)//steps_per_game)
+        model.save(model_save)
+        if sb3_options.get('save_replay_buffer', False):
+            save_replay_buffer(model, model_save)
+        vec_env.close()
+        if reward_model_manager is not None:
+            reward_model_manager.shutdown()
+        log.write('optimization_track_file.txt', meter.summary())
+        log.write('optimization_track_file.txt', "End of Optimization \n")
+        shipper.stop()
 
         opt.plotter()
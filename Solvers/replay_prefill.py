@@ -0,0 +1,223 @@
+import os
+import copy
+import json
+import numpy
+import yaml
+from .result_store import read_results, decode_genome
+
+"""
+This file contains the pre-filling of the replay buffers of the off-policy
+reinforcement learning algorithms (SAC, DQN) from loading patterns evaluated
+in earlier runs. Every historical loading pattern is turned into the episode
+an environment would have played to place it: one transition per placement,
+with a zero reward, and a final transition rewarded with the fitness the
+environment gives the evaluated pattern. The policy then starts learning
+from these episodes instead of from an empty buffer.
+
+Loading patterns are read from the result store (all_value_tracker.h5),
+evaluation journals and the optimized_solutions.yaml written for restarts.
+Their genomes must hold one gene per fuel location of the environment, in
+the order of its fuel locations, as recorded by the environments themselves.
+Patterns that do not fit the environment are skipped and counted, so genetic
+algorithm or simulated annealing histories whose genomes follow another
+layout show up as skipped patterns rather than as a silently empty prefill.
+"""
+
+
+def replay_buffer_file(model_save):
+    """
+    Returns the file the replay buffer of a model saved at model_save is
+    kept in.
+    """
+    return f"{model_save}_replay_buffer.pkl"
+
+
+def _as_list(files):
+    if not files:
+        return []
+    if isinstance(files, str):
+        return [files]
+    return list(files)
+
+
+def historical_evaluations(results=(), journals=(), solutions=()):
+    """
+    Yields the genome and objective values of every evaluated loading pattern
+    in the given files.
+
+    Parameters:
+        results: list
+            Result stores written by Result_Store.
+        journals: list
+            Evaluation journals written by Evaluation_Journal.
+        solutions: list
+            Solution files in the layout of optimized_solutions.yaml.
+    """
+    for file_name in _as_list(results):
+        stored = read_results(file_name)
+        if 'name' not in stored:
+            continue
+        for encoded_genome, objectives in zip(stored['genome'], stored['objectives']):
+            values = {name: float(value) for name, value in zip(stored['objective_names'], objectives)
+                      if not numpy.isnan(value)}
+            yield decode_genome(encoded_genome, stored['gene_key']), values
+    for file_name in _as_list(journals):
+        with open(file_name) as ifile:
+            for line in ifile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry.get('genome'), list):
+                    yield entry['genome'], entry['values']
+    for file_name in _as_list(solutions):
+        with open(file_name) as ifile:
+            solution_dict = yaml.safe_load(ifile)
+        for name in solution_dict:
+            values = {}
+            for param, value in solution_dict[name]['parameters'].items():
+                if isinstance(value, dict) and 'value' in value:
+                    values[param] = value['value']
+            yield solution_dict[name]['genome'], values
+
+
+def terminal_state(env, genome):
+    """
+    Returns the core state a genome describes in the environment, or None if
+    the genome does not fit the fuel locations and inventory of the
+    environment.
+    """
+    fuel = env.solution.core_dict['fuel']
+    if len(genome) != len(fuel):
+        return None
+    state = {}
+    for key, gene in zip(fuel, genome):
+        if gene not in env.cmap:
+            gene = str(gene)
+        if gene not in env.cmap:
+            return None
+        state[key] = gene
+
+    return state
+
+
+def episode_transitions(env, genome, values):
+    """
+    Returns the transitions of the episode placing the loading pattern of the
+    genome, as (observation, next observation, action, reward, done) tuples,
+    or None if the pattern does not fit the environment.
+
+    Parameters:
+        env: Class
+            Cycle1_Gym_Env or MCycle_Gym_Env the transitions are built for.
+        genome: list
+            Genes of the loading pattern, one per fuel location.
+        values: dict
+            Objective values of the evaluated loading pattern.
+    """
+    from .reinforcement_learning import Observation_Buffer
+    state = terminal_state(env, genome)
+    if state is None:
+        return None
+    locations = [env.step_location(counter) for counter in range(len(env.order))]
+    if any(location not in state for location in locations):
+        return None
+
+    solution = copy.deepcopy(env.solution)
+    solution.set_state(env.start)
+    observation = Observation_Buffer(env.cmap, env.observation_type)
+    obs = observation.reset(solution, 0).copy()
+    transitions = []
+    for counter, location in enumerate(locations):
+        if env.action_type == 'discrete':
+            action = env.cmap[state[location]]
+        else:
+            action = numpy.array([env.cmap[state[location]]], dtype=numpy.float32)
+        solution.mapaction({'Location': location,
+                            'Value': action,
+                            'Space': env.action_type,
+                            'Action_Map': env.cmap})
+        done = counter == len(locations) - 1
+        reward = 0
+        if done:
+            for param in values:
+                if param in solution.parameters:
+                    solution.parameters[param]['value'] = values[param]
+            solution = env.fitness.calculate([solution])[0]
+            if env.fitness_const:
+                solution.fitness = solution.get_fitness()
+            reward = solution.fitness
+        next_obs = observation.update(solution, location, 0 if done else counter + 1).copy()
+        transitions.append((obs, next_obs, action, reward, done))
+        obs = next_obs
+
+    return transitions
+
+
+def prefill_replay_buffer(model, env, results=(), journals=(), solutions=()):
+    """
+    Adds the episodes of historical loading patterns to the replay buffer of
+    an off-policy model. Returns the number of episodes added and the number
+    of patterns skipped because they do not fit the environment, and warns
+    when no episode was added.
+
+    The buffer stores one transition per environment of the model at a time,
+    so episodes are added in groups of n_envs and a last incomplete group is
+    left out.
+
+    Parameters:
+        model: Class
+            SAC or DQN model.
+        env: Class
+            Environment the episodes are built for, in this process.
+        results, journals, solutions: list
+            Files read by historical_evaluations.
+    """
+    if getattr(model, 'replay_buffer', None) is None:
+        print(f"{type(model).__name__} has no replay buffer, skipping the prefill.")
+        return 0, 0
+    n_envs = model.n_envs
+    episodes = []
+    added = 0
+    skipped = 0
+    for genome, values in historical_evaluations(results, journals, solutions):
+        transitions = episode_transitions(env, genome, values)
+        if transitions is None:
+            skipped += 1
+            continue
+        episodes.append(transitions)
+        if len(episodes) < n_envs:
+            continue
+        for step in zip(*episodes):
+            obs, next_obs, action, reward, done = zip(*step)
+            model.replay_buffer.add(numpy.array(obs), numpy.array(next_obs), numpy.array(action),
+                                    numpy.array(reward, dtype=numpy.float32), numpy.array(done),
+                                    [{} for _ in range(n_envs)])
+        added += n_envs
+        episodes = []
+    if added == 0:
+        print(f"Warning: no historical episodes were added to the replay buffer. {skipped} loading patterns "
+              f"do not fit the fuel locations and inventory of the environment, and {len(episodes)} that do "
+              f"are fewer than the {n_envs} environments of the model.")
+
+    return added, skipped
+
+
+def load_replay_buffer(model, model_save):
+    """
+    Loads the replay buffer saved next to model_save into the model, if it
+    exists. Returns True if a buffer was loaded.
+    """
+    buffer_file = replay_buffer_file(model_save)
+    if getattr(model, 'replay_buffer', None) is None or not os.path.isfile(buffer_file):
+        return False
+    model.load_replay_buffer(buffer_file)
+    return True
+
+
+def save_replay_buffer(model, model_save):
+    """
+    Saves the replay buffer of the model next to model_save.
+    """
+    if getattr(model, 'replay_buffer', None) is not None:
+        model.save_replay_buffer(replay_buffer_file(model_save))
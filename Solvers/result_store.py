@@ -0,0 +1,254 @@
+import os
+import time
+import numpy
+
+"""
+This file contains the structured result store used by the solvers to record
+every evaluated solution. It replaces the comma separated text written to
+all_value_tracker.txt with extensible HDF5 datasets, so that post-processing
+a run is a matter of reading arrays rather than parsing text.
+
+Layout of the store:
+    name        (N,)            variable length string
+    genome      (N, L)          int32, genes encoded through the 'gene_key' attribute
+    objectives  (N, M)          float64, columns named by the 'objective_names' attribute
+    fitness     (N,)            float64, NaN when fitness was not calculated
+    generation  (N,)            int64
+    wall_time   (N,)            float64, seconds since the epoch
+    worker      (N,)            int64, -1 for the master process
+
+h5py is only imported where a store is opened, so worker processes that
+build records and ship them to the master never load it.
+"""
+
+STORE_FILE = 'all_value_tracker.h5'
+
+
+def _flatten_genome(genome):
+    """
+    Returns the genome as a flat list of genes. Dictionary genomes are
+    flattened in key order.
+    """
+    if genome is None:
+        return []
+    if isinstance(genome, dict):
+        flat = []
+        for key in sorted(genome):
+            flat.extend(_flatten_genome(genome[key]))
+        return flat
+    if isinstance(genome, (list, tuple, numpy.ndarray)):
+        return list(genome)
+    return [genome]
+
+
+def _as_float(value):
+    """
+    Converts an objective value to a float, NaN if it can't be.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return numpy.nan
+
+
+def solution_record(solution, generation=-1, worker=-1, fitness=None, wall_time=None, genome=None):
+    """
+    Returns the record of an evaluated solution as a plain tuple, so it can
+    be built in a worker process and appended to a store elsewhere.
+    """
+    if fitness is None:
+        fitness = getattr(solution, 'fitness', None)
+    if genome is None:
+        genome = getattr(solution, 'genome', None)
+    values = {}
+    for param in solution.parameters:
+        values[param] = _as_float(solution.parameters[param].get('value'))
+
+    return (str(solution.name),
+            [str(gene) for gene in _flatten_genome(genome)],
+            values,
+            _as_float(fitness),
+            int(generation),
+            time.time() if wall_time is None else wall_time,
+            int(worker))
+
+
+class Result_Store(object):
+    """
+    Buffered writer for the HDF5 result store.
+
+    Records are kept in memory and appended to the extensible datasets once
+    the buffer holds chunk_size records, or when flush/close is called. The
+    file is only opened for the duration of a flush, so several stores in the
+    same process may share one file as long as they do not flush at the same
+    time.
+
+    Parameters:
+        file_name: str
+            Path of the HDF5 file.
+        chunk_size: int
+            Number of records buffered before they are written to disk.
+        mode: str
+            'w' starts a new store, 'a' appends to an existing one.
+    """
+    def __init__(self, file_name=STORE_FILE, chunk_size=256, mode='w'):
+        import h5py
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        self.objective_names = None
+        self.buffer = []
+        self.count = 0
+        if mode == 'w' or not os.path.isfile(file_name):
+            with h5py.File(file_name, 'w') as store:
+                store.attrs['gene_key'] = numpy.array([], dtype=h5py.string_dtype())
+        else:
+            with h5py.File(file_name, 'r') as store:
+                if 'objectives' in store:
+                    self.objective_names = [str(obj) for obj in store['objectives'].attrs['objective_names']]
+                if 'name' in store:
+                    self.count = store['name'].shape[0]
+
+    def record(self, solution, generation=-1, worker=-1, fitness=None, wall_time=None, genome=None):
+        """
+        Adds an evaluated solution to the store.
+
+        Parameters:
+            solution: Class
+                Evaluated solution with a name, genome and parameters.
+            generation: int
+                Generation in which the solution was evaluated.
+            worker: int
+                Index of the worker that evaluated the solution.
+            fitness: float
+                Fitness of the solution. Taken from the solution if not given.
+            wall_time: float
+                Time the evaluation finished. Defaults to now.
+            genome: list
+                Genes to store. Taken from the solution if not given.
+        """
+        self.append(solution_record(solution, generation, worker, fitness, wall_time, genome))
+
+    def append(self, record):
+        """
+        Adds a record built by solution_record to the store.
+        """
+        if self.objective_names is None:
+            self.objective_names = list(record[2].keys())
+        self.buffer.append(record)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def record_all(self, solution_list, generation=-1, worker=-1):
+        """
+        Adds every solution in the list to the store.
+        """
+        for solution in solution_list:
+            self.record(solution, generation, worker)
+
+    def flush(self):
+        """
+        Appends the buffered records to the datasets on disk.
+        """
+        if not self.buffer:
+            return
+        import h5py
+        names, genomes, values, fitness, generation, wall_time, worker = zip(*self.buffer)
+        number = len(names)
+        objectives = [[value.get(param, numpy.nan) for param in self.objective_names] for value in values]
+        genome_length = max(len(genome) for genome in genomes)
+
+        with h5py.File(self.file_name, 'a') as store:
+            # genes are encoded against the key on disk so that stores sharing
+            # a file agree on the encoding
+            gene_key = [str(gene) for gene in store.attrs.get('gene_key', [])]
+            gene_index = {gene: i for i, gene in enumerate(gene_key)}
+            genome_array = numpy.full((number, genome_length), -1, dtype=numpy.int32)
+            for i, genome in enumerate(genomes):
+                for j, gene in enumerate(genome):
+                    if gene not in gene_index:
+                        gene_index[gene] = len(gene_key)
+                        gene_key.append(gene)
+                    genome_array[i, j] = gene_index[gene]
+
+            if 'name' not in store:
+                string_type = h5py.string_dtype()
+                store.create_dataset('name', (0,), maxshape=(None,), dtype=string_type,
+                                     chunks=(self.chunk_size,))
+                store.create_dataset('genome', (0, genome_length), maxshape=(None, None),
+                                     dtype=numpy.int32, chunks=(self.chunk_size, max(genome_length, 1)),
+                                     fillvalue=-1)
+                store.create_dataset('objectives', (0, len(self.objective_names)),
+                                     maxshape=(None, len(self.objective_names)), dtype=numpy.float64,
+                                     chunks=(self.chunk_size, max(len(self.objective_names), 1)))
+                store['objectives'].attrs['objective_names'] = numpy.array(self.objective_names,
+                                                                           dtype=h5py.string_dtype())
+                for key, dtype in (('fitness', numpy.float64), ('generation', numpy.int64),
+                                   ('wall_time', numpy.float64), ('worker', numpy.int64)):
+                    store.create_dataset(key, (0,), maxshape=(None,), dtype=dtype,
+                                         chunks=(self.chunk_size,))
+            start = store['name'].shape[0]
+            end = start + number
+            if store['genome'].shape[1] < genome_length:
+                store['genome'].resize(genome_length, axis=1)
+            for key in ('name', 'genome', 'objectives', 'fitness', 'generation', 'wall_time', 'worker'):
+                store[key].resize(end, axis=0)
+            store['name'][start:end] = names
+            store['genome'][start:end, :genome_length] = genome_array
+            store['objectives'][start:end] = numpy.array(objectives, dtype=numpy.float64)
+            store['fitness'][start:end] = fitness
+            store['generation'][start:end] = generation
+            store['wall_time'][start:end] = wall_time
+            store['worker'][start:end] = worker
+            store.attrs['gene_key'] = numpy.array(gene_key, dtype=h5py.string_dtype())
+
+        self.count = end
+        self.buffer = []
+
+    def truncate(self, count):
+        """
+        Discards buffered records and every record on disk after the first
+        count, e.g. records written after the checkpoint a run restarts from.
+        """
+        import h5py
+        self.buffer = []
+        with h5py.File(self.file_name, 'a') as store:
+            if 'name' in store and store['name'].shape[0] > count:
+                for key in ('name', 'genome', 'objectives', 'fitness', 'generation', 'wall_time', 'worker'):
+                    store[key].resize(count, axis=0)
+        self.count = min(self.count, count)
+
+    def close(self):
+        """
+        Writes any remaining records to disk.
+        """
+        self.flush()
+
+
+def read_results(file_name=STORE_FILE):
+    """
+    Reads a result store written by Result_Store.
+
+    Returns a dictionary of NumPy arrays keyed by dataset name, together with
+    'gene_key' and 'objective_names' for decoding the genome and objective
+    columns.
+    """
+    import h5py
+    results = {}
+    with h5py.File(file_name, 'r') as store:
+        results['gene_key'] = [str(gene) for gene in store.attrs['gene_key']]
+        if 'name' not in store:
+            results['objective_names'] = []
+            return results
+        results['objective_names'] = [str(obj) for obj in store['objectives'].attrs['objective_names']]
+        results['name'] = store['name'].asstr()[()]
+        for key in ('genome', 'objectives', 'fitness', 'generation', 'wall_time', 'worker'):
+            results[key] = store[key][()]
+
+    return results
+
+
+def decode_genome(encoded_genome, gene_key):
+    """
+    Returns the list of genes described by one row of the genome dataset.
+    """
+    return [gene_key[gene] for gene in encoded_genome if gene >= 0]
@@ -0,0 +1,232 @@
+import threading
+import numpy
+from multiprocessing.managers import BaseManager
+from scipy.linalg import cho_factor, cho_solve
+
+"""
+This file contains the surrogate reward model of the reinforcement learning
+environments. The model learns the objective values of the terminal core
+states of episodes as they are simulated, and once it has seen enough of
+them it scores most episodes in place of the simulation.
+
+The model is a Bayesian linear regression on a one-hot encoding of the
+assembly at each fuel location. Its sufficient statistics are updated as
+every simulated state arrives and the weights are refit every few states.
+Besides a prediction, it gives the standard deviation of the prediction due
+to the states seen so far, which is large for states unlike any simulated
+one; those states are simulated rather than imagined.
+
+A refit takes the Cholesky factor of the regularized gram matrix, and a
+prediction solves against it, so the covariance of the weights is never
+formed. Only the sufficient statistics are pickled, e.g. into training
+checkpoints, and the weights are refit from them. Environments running in
+separate processes share one model served by a Reward_Model_Manager, so
+every simulated state teaches the same model.
+"""
+
+
+class Reward_Model(object):
+    """
+    Online surrogate of the objective values of terminal core states.
+
+    Parameters:
+        locations: list
+            Fuel locations of the core state. Taken from the first state
+            learned if None.
+        inventory: list
+            Assemblies that may be placed at the locations.
+        objectives: list
+            Names of the objectives predicted.
+        real_fraction: float
+            Fraction of the episodes simulated even when the model is
+            confident, so it keeps learning from the states the policy visits.
+        uncertainty: float
+            Largest standard deviation of a prediction, relative to the
+            spread of the simulated values of the objective, for which the
+            prediction is used.
+        min_samples: int
+            Number of simulated states seen before any prediction is used.
+        regularization: float
+            Precision of the prior on the regression weights.
+        refit_interval: int
+            Number of new simulated states between refits of the weights.
+        seed: int
+            Seed of the choice of the episodes simulated.
+    """
+    def __init__(self, locations, inventory, objectives, real_fraction=0.1, uncertainty=0.25,
+                 min_samples=50, regularization=1.0, refit_interval=16, seed=None):
+        self.assembly = {assembly: j for j, assembly in enumerate(inventory)}
+        self.objectives = list(objectives)
+        self.real_fraction = real_fraction
+        self.uncertainty = uncertainty
+        self.min_samples = max(int(min_samples), 1)  # the first episode is always simulated
+        self.regularization = regularization
+        self.refit_interval = refit_interval
+        self.rng = numpy.random.default_rng(seed)
+
+        self.position = None
+        self.gram = None  # X^T X
+        self.moment = None  # X^T y
+        if locations is not None:
+            self._allocate(locations)
+        self.total = numpy.zeros(len(self.objectives))
+        self.total_squares = numpy.zeros(len(self.objectives))
+        self.count = 0
+        self.since_fit = 0
+        self.weights = None
+        self.factor = None  # Cholesky factor of X^T X + regularization I
+        self.noise = None  # residual variance of each objective
+        self.imagined = 0  # episodes scored by the model
+        self.simulated = 0  # episodes scored by the simulation
+        self.lock = threading.Lock()  # environments served by a manager call in from several threads
+
+    def _allocate(self, locations):
+        """
+        Sizes the sufficient statistics for the fuel locations.
+        """
+        self.position = {location: i for i, location in enumerate(locations)}
+        size = len(self.position)*len(self.assembly) + 1
+        self.gram = numpy.zeros((size, size))
+        self.moment = numpy.zeros((size, len(self.objectives)))
+
+    def _active(self, state):
+        """
+        Returns the active one-hot features of a state, or None if the state
+        holds a location or assembly the model does not know.
+        """
+        if self.position is None:
+            return None
+        active = [len(self.position)*len(self.assembly)]  # bias
+        for location, assembly in state.items():
+            if location not in self.position or assembly not in self.assembly:
+                return None
+            active.append(self.position[location]*len(self.assembly) + self.assembly[assembly])
+        return numpy.array(active)
+
+    def __getstate__(self):
+        # the fit is recomputed from the sufficient statistics
+        state = self.__dict__.copy()
+        state['weights'] = None
+        state['factor'] = None
+        state['noise'] = None
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def add(self, state, values):
+        """
+        Learns the simulated objective values of a state.
+        """
+        with self.lock:
+            self._add(state, values)
+
+    def _add(self, state, values):
+        if self.position is None:
+            self._allocate(list(state))
+        active = self._active(state)
+        if active is None:
+            return
+        try:
+            target = numpy.array([float(values[name]) for name in self.objectives])
+        except (KeyError, TypeError, ValueError):
+            return
+        if not numpy.all(numpy.isfinite(target)):
+            return
+        self.gram[numpy.ix_(active, active)] += 1
+        self.moment[active] += target
+        self.total += target
+        self.total_squares += target**2
+        self.count += 1
+        self.since_fit += 1
+
+    def _fit(self):
+        """
+        Factors the posterior precision of the weights and solves for their
+        posterior mean.
+        """
+        precision = self.gram + self.regularization*numpy.eye(self.gram.shape[0])
+        self.factor = cho_factor(precision, lower=True, overwrite_a=True, check_finite=False)
+        self.weights = cho_solve(self.factor, self.moment, check_finite=False)
+        # residual sum of squares from the sufficient statistics
+        residual = (self.total_squares - 2*numpy.sum(self.weights*self.moment, axis=0)
+                    + numpy.sum(self.weights*(self.gram @ self.weights), axis=0))
+        self.noise = numpy.maximum(residual, 0.) / self.count
+        self.since_fit = 0
+
+    def predict(self, state):
+        """
+        Returns the predicted objective values of the state, and the largest
+        standard deviation of the predictions relative to the spread of the
+        simulated values. Returns None if the model cannot predict the state.
+        """
+        with self.lock:
+            return self._predict(state)
+
+    def _predict(self, state):
+        active = self._active(state)
+        if active is None or self.count < self.min_samples:
+            return None
+        if self.weights is None or self.since_fit >= self.refit_interval:
+            self._fit()
+        prediction = self.weights[active].sum(axis=0)
+        # x^T (X^T X + regularization I)^-1 x for the one-hot features x
+        features = numpy.zeros(self.gram.shape[0])
+        features[active] = 1.
+        leverage = cho_solve(self.factor, features, check_finite=False)[active].sum()
+        spread = self.total_squares/self.count - (self.total/self.count)**2
+        deviation = numpy.sqrt(self.noise*leverage)
+        relative = numpy.max(deviation / numpy.sqrt(numpy.maximum(spread, 1e-12)))
+
+        return dict(zip(self.objectives, prediction.tolist())), relative
+
+    def imagine(self, state):
+        """
+        Returns the objective values to score the state with in place of a
+        simulation, or None if the state has to be simulated.
+        """
+        with self.lock:
+            predicted = None
+            if self.rng.random() >= self.real_fraction:
+                predicted = self._predict(state)
+            if predicted is None or predicted[1] > self.uncertainty:
+                self.simulated += 1
+                return None
+            self.imagined += 1
+            return predicted[0]
+
+    def imagined_rate(self):
+        """
+        Fraction of the episodes scored by the model.
+        """
+        episodes = self.imagined + self.simulated
+        return self.imagined / episodes if episodes else 0.
+
+    def checkpoint(self):
+        """
+        Returns the sufficient statistics and counters of the model, as saved
+        in training checkpoints.
+        """
+        with self.lock:
+            return self.__getstate__()
+
+    def restore(self, state):
+        """
+        Restores the model to a state from checkpoint, in place.
+        """
+        with self.lock:
+            self.__dict__.update(state)
+            self.weights = None
+
+
+class Reward_Model_Manager(BaseManager):
+    """
+    Manager serving one Reward_Model to environments running in separate
+    processes, through proxies exposing its public methods.
+    """
+
+
+Reward_Model_Manager.register('Reward_Model', Reward_Model,
+                              exposed=('add', 'predict', 'imagine', 'imagined_rate', 'checkpoint', 'restore'))
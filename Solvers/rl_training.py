@@ -0,0 +1,102 @@
+from stable_baselines3.common.vec_env import DummyVecEnv
+from stable_baselines3.common.callbacks import BaseCallback
+from .reinforcement_learning import Reward_Cache, episode_state, last_episode_parent, keep_last_episode
+from .evaluation_journal import journal_entry, replay_entry
+from .delta_evaluation import evaluate_from_parent
+from .worker_runtime import solver_pool
+
+"""
+This file contains the stable_baselines3 classes of the reinforcement
+learning solver, the batched vectorized environment and the checkpoint
+callback. They subclass stable_baselines3 classes, so they live apart from
+the environments and are only imported by the solver's main functions. The
+environment module then only needs gym, and processes that unpickle the
+environments do not load stable_baselines3 and torch through it.
+"""
+
+
+class Batched_Evaluation_VecEnv(DummyVecEnv):
+    """
+    Vectorized environment that steps its environments in lockstep in this
+    process and evaluates the solutions that end their episodes as one batch
+    on a process pool.
+
+    The placement steps of an episode cost next to nothing, while the final
+    step runs the core simulation. Before the environments are stepped, the
+    solutions completed by the final actions are collected and evaluated
+    together, and each environment then finishes its step from the evaluated
+    solution, so rewards, Monitor output and best solution tracking are
+    unchanged. Each solution is evaluated from the last episode of its
+    environment, as in evaluate_from_last_episode, and a state that ends
+    several episodes of the batch is simulated once.
+
+    Parameters:
+        env_fns: list
+            Functions building the environments.
+        num_procs: int
+            Number of processes evaluating the solutions.
+        runtime: Class
+            Worker_Runtime of the evaluating processes, or None.
+    """
+    def __init__(self, env_fns, num_procs, runtime=None):
+        DummyVecEnv.__init__(self, env_fns)
+        self.pool = solver_pool(runtime, num_procs)
+
+    def step_wait(self):
+        batch = {}  # terminal state key -> environments ending their episodes in it, with their solutions
+        for env_idx in range(self.num_envs):
+            env = self.envs[env_idx].unwrapped
+            solution = env.terminal_solution(self.actions[env_idx])
+            if solution is not None and env.reward_cache is not None and env.reward_cache.lookup(solution) is not None:
+                continue
+            if solution is not None and env.imagine(solution) is not None:
+                continue
+            if solution is not None:
+                batch.setdefault(Reward_Cache.key(solution), []).append((env, solution))
+        if batch:
+            arguments = []
+            for members in batch.values():
+                env, solution = members[0]
+                parent, positions = last_episode_parent(env, episode_state(solution))
+                arguments.append((solution, parent, positions))
+            for members, evaluated in zip(batch.values(), self.pool.starmap(evaluate_from_parent, arguments)):
+                state = episode_state(evaluated)
+                entry = journal_entry(evaluated)
+                for i, (env, solution) in enumerate(members):
+                    # the other episodes ending in the state take its values under their own names
+                    env.prefetched = evaluated if i == 0 else replay_entry(solution, entry)
+                    keep_last_episode(env, evaluated, state)
+
+        return DummyVecEnv.step_wait(self)
+
+    def close(self):
+        DummyVecEnv.close(self)
+        self.pool.close()
+        self.pool.join()
+
+
+class Checkpoint_Callback(BaseCallback):
+    """
+    Writes a checkpoint of the training every save_frequency time steps.
+
+    Parameters:
+        checkpoint: function
+            Called with the model and its vectorized environment to write
+            the checkpoint.
+        save_frequency: int
+            Number of time steps between checkpoints.
+    """
+    def __init__(self, checkpoint, save_frequency):
+        super(Checkpoint_Callback, self).__init__()
+        self.checkpoint = checkpoint
+        self.save_frequency = save_frequency
+        self.last_save = 0
+
+    def _on_training_start(self):
+        self.last_save = self.num_timesteps
+
+    def _on_step(self):
+        if self.num_timesteps - self.last_save >= self.save_frequency:
+            self.checkpoint(self.model, self.training_env)
+            self.last_save = self.num_timesteps
+        return True
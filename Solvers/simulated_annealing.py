@@ -1,14 +1,27 @@
 import os
 import sys
 import copy
+import heapq
+import collections
 import math
+import hashlib
 import numpy
 import random
 import statistics
 import shutil
+from contextlib import nullcontext
 from multiprocessing import Pool
+from multiprocessing.managers import BaseManager
 from midas.utils.solution_types import evaluate_function
 from midas.utils.metrics import Simulated_Annealing_Metric_Toolbox
+from .result_store import Result_Store
+from .log_shipper import Log_Client, Log_Shipper
+from .evaluation_journal import Evaluation_Journal, genome_key, journal_entry, replay_entry
+from .solution_registry import Solution_Registry
+from .solution_archive import cleanup_action
+from .delta_evaluation import evaluate_from_parent
+from .checkpoint import capture_rng_state, restore_rng_state, write_checkpoint, read_checkpoint
+from .worker_runtime import runtime_from_settings, solver_pool, solver_executor, pool_layout, Throughput_Meter
 import multiprocessing
 
 
@@ -115,66 +128,264 @@ class Exponential_Decreasing_Cooling_Schedule(object):
             self.temperature *= self.alpha
 
 
-def SA(x, k, active, Buffer, BufferCost, self, opt):
+BUFFER_SCALING_FACTOR = 100  # Scale of the costs when sampling the buffer.
+
+
+def boltzmann_probabilities(costs, scale):
     """
-    Created by Jake Mikouchi
-    2/10/23
+    Returns the Boltzmann probability exp(-cost/scale)/Z of each cost.
+
+    The exponent is shifted by its maximum before exponentiating, so large
+    costs do not underflow every probability to zero.
     """
+    exponent = -numpy.asarray(costs, dtype=float) / scale
+    finite = numpy.isfinite(exponent)
+    if not finite.any():
+        return numpy.full(len(exponent), 1. / len(exponent))
+    exponent = numpy.where(finite, exponent - exponent[finite].max(), -numpy.inf)
+    weights = numpy.exp(exponent)
 
-    def UpdateActive(Buffer, BufferCost):
-        # finds the sum of the probability of each position in the Buffer
-        scalingfactor = 100
-        SumProb = 0
-        for i in range(len(BufferCost)):
-            # CurrProb = numpy.exp((-1 * BufferCost[i]) / temp)
-            CurrProb = numpy.exp((-1 * BufferCost[i]) / scalingfactor)
-
-            SumProb += CurrProb
-
-        # finds the probability that each position of the buffer will be selected
-        PositionProb = []
-        for i in range(len(BufferCost)):
-            # CurrProb = numpy.exp((-1 * BufferCost[i]) / temp)
-            CurrProb = numpy.exp((-1 * BufferCost[i]) / scalingfactor)
-
-            TotalProb = (CurrProb / SumProb)
-
-            PositionProb.append(TotalProb)
-
-        # uses the probabilities to select which lists to add to the buffer
-        SumProblist = []
-        for i in range(len(Buffer)):
-            if i >= 1:
-                SumProblist.append(SumProblist[i - 1] + PositionProb[i])
-            if i == 0:
-                SumProblist.append(PositionProb[i])
-
-        randomnum = random.uniform(0, 1)
-
-        for i in range(len(Buffer)):
-            if i == 0:
-                if randomnum < SumProblist[i]:
-                    acceptedlist = Buffer[i]
-                    acceptedlistCost = BufferCost[i]
-                    break
-            if i >= 1:
-                if randomnum < SumProblist[i] and randomnum >= SumProblist[i - 1]:
-                    acceptedlist = Buffer[i]
-                    acceptedlistCost = BufferCost[i]
-                    break
+    return weights / weights.sum()
 
-        return acceptedlist, acceptedlistCost
 
-    if x == 0:
-        active = active
-    else:
-        active, activeCost = UpdateActive(Buffer, BufferCost)
+def boltzmann_sample(costs, scale, size=None):
+    """
+    Draws buffer positions with Boltzmann probabilities of their costs.
+
+    Parameters:
+        costs: list
+            Costs of the buffer positions.
+        scale: float
+            Temperature or scaling factor dividing the costs.
+        size: int
+            Number of positions to draw. A single position is returned if None.
+    """
+    cumulative = numpy.cumsum(boltzmann_probabilities(costs, scale))
+    draws = numpy.random.random_sample(size) * cumulative[-1]
+    positions = numpy.searchsorted(cumulative, draws, side='right')
+
+    return numpy.minimum(positions, len(cumulative) - 1)
+
+
+class Solution_Buffer(object):
+    """
+    Bounded buffer of the lowest cost solutions found by parallel simulated annealing.
+
+    The buffer is a max-heap on cost holding at most buffer_length solutions,
+    so a proposal is either rejected against the worst member or swapped in
+    for it in O(log buffer_length). Solutions are deduplicated on the hash of
+    their genome, so different genomes with equal fitness are both kept.
+
+    Parameters:
+        buffer_length: int
+            Maximum number of solutions held in the buffer.
+    """
+    def __init__(self, buffer_length):
+        self.buffer_length = buffer_length
+        self.heap = []        # entries are (-cost, order, key, solution)
+        self.members = set()  # genome keys of the solutions in the heap
+        self.order = 0        # breaks ties between equal costs without comparing solutions
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, solution, cost):
+        """
+        Offers a solution to the buffer. Returns True if it was kept.
+        """
+        key = genome_key(solution.genome)
+        if key in self.members:
+            return False
+        entry = (-cost, self.order, key, solution)
+        self.order += 1
+        if len(self.heap) < self.buffer_length:
+            heapq.heappush(self.heap, entry)
+        elif cost < -self.heap[0][0]:
+            worst = heapq.heapreplace(self.heap, entry)
+            self.members.discard(worst[2])
+        else:
+            return False
+        self.members.add(key)
+
+        return True
+
+    def merge(self, solutions, costs):
+        """
+        Offers every solution in the list with its cost to the buffer.
+        """
+        for solution, cost in zip(solutions, costs):
+            self.push(solution, cost)
+
+    def contents(self):
+        """
+        Returns the solutions in the buffer and their costs, lowest cost first.
+        """
+        entries = sorted(self.heap, key=lambda entry: (-entry[0], entry[1]))
+        return [entry[3] for entry in entries], [-entry[0] for entry in entries]
+
+
+class Visited_States(object):
+    """
+    Bounded memory of the genomes simulated annealing has recently evaluated.
+
+    Chains at low temperature, and Fixed_Genome_Mutator swaps that undo one
+    another, keep proposing genomes that were just evaluated. The memory maps
+    the hash of each genome to its objective values, so a repeated proposal
+    is either served from memory or rejected and proposed again instead of
+    being simulated. Only a digest of the genome and the objective values
+    are kept, since parallel simulated annealing sends the memory to every
+    chain each generation.
+
+    Parameters:
+        size: int
+            Maximum number of genomes remembered. The oldest are forgotten first.
+        time_to_live: int
+            Number of generations a genome is remembered for.
+        policy: str
+            'serve' fills in a repeated genome from memory, 'reject' proposes
+            another genome in its place.
+        retries: int
+            Proposals drawn under the 'reject' policy before a repeated genome
+            is served from memory anyway.
+    """
+    def __init__(self, size=10000, time_to_live=10, policy='serve', retries=10):
+        if policy not in ('serve', 'reject'):
+            raise ValueError(f"Unknown visited state policy {policy}, expected 'serve' or 'reject'.")
+        self.size = size
+        self.time_to_live = time_to_live
+        self.policy = policy
+        self.retries = retries
+        self.generation = 0
+        self.states = collections.OrderedDict()  # genome digest -> (generation, objective values)
+
+    def __len__(self):
+        return len(self.states)
+
+    @staticmethod
+    def key(genome):
+        """
+        Returns the digest the genome is remembered by.
+        """
+        return hashlib.blake2b(genome_key(genome).encode(), digest_size=16).digest()
+
+    def lookup(self, genome):
+        """
+        Returns the objective values of the genome, as an entry replay_entry
+        fills a solution in from, if it is remembered, or None.
+        """
+        state = self.states.get(self.key(genome))
+        if state is None or self.generation - state[0] > self.time_to_live:
+            return None
+        return state[1]
+
+    def add(self, solution, generation):
+        """
+        Remembers an evaluated solution, forgetting the oldest genomes once
+        the memory is full. A genome already remembered keeps the generation
+        it was first evaluated in, so serving it does not extend its life.
+        """
+        key = self.key(solution.genome)
+        if key in self.states:
+            return
+        self.states[key] = (generation, {'values': journal_entry(solution)['values']})
+        while len(self.states) > self.size:
+            self.states.popitem(last=False)
+
+    def expire(self, generation):
+        """
+        Moves the memory on to the given generation and forgets the genomes
+        older than the time to live.
+        """
+        self.generation = generation
+        while self.states:
+            key, state = next(iter(self.states.items()))
+            if generation - state[0] <= self.time_to_live:
+                break
+            del self.states[key]
+
+
+def temperature_ladder(temperature, number, ratio):
+    """
+    Returns the temperatures of the replicas, spaced geometrically from the
+    given temperature up to ratio times it. The first replica is the coldest.
+    """
+    if number == 1:
+        return [temperature]
+    return [temperature * ratio ** (k / (number - 1)) for k in range(number)]
+
+
+def replica_exchange(states, costs, ladder, parity):
+    """
+    Attempts Metropolis swaps of the states held by neighbouring replicas.
+
+    Replicas (k, k+1) are paired starting from k = parity, so alternating the
+    parity between exchanges lets a state travel the whole ladder. A swap is
+    accepted with probability min(1, exp((1/T_k - 1/T_k+1)(E_k - E_k+1))).
+
+    Returns the states and costs after the exchange and the number of swaps
+    accepted.
+    """
+    states = list(states)
+    costs = list(costs)
+    accepted = 0
+    for k in range(parity, len(states) - 1, 2):
+        exponent = (1. / ladder[k] - 1. / ladder[k + 1]) * (costs[k] - costs[k + 1])
+        if exponent >= 0 or random.uniform(0, 1) < math.exp(exponent):
+            states[k], states[k + 1] = states[k + 1], states[k]
+            costs[k], costs[k + 1] = costs[k + 1], costs[k]
+            accepted += 1
+
+    return states, costs, accepted
+
+
+def _evaluation_pool(runtime, processes):
+    """
+    Returns the process pool served by an Evaluation_Manager.
+    """
+    return solver_pool(runtime, processes)
+
+
+class Evaluation_Manager(BaseManager):
+    """
+    Manager serving the process pool that the chains of parallel simulated
+    annealing share to evaluate their neighbour batches. The chains run in
+    pool workers, which cannot start processes of their own, so they reach
+    the shared pool through a proxy. Every evaluation runs in a process of
+    its own, as the simulators require.
+    """
+
+
+Evaluation_Manager.register('Evaluation_Pool', _evaluation_pool, exposed=('starmap', 'terminate'))
+
+
+def SA(x, k, active, Buffer, BufferCost, self, opt, log=None, seed=None, temp=None, evaluation_pool=None):
+    """
+    Created by Jake Mikouchi
+    2/10/23
+
+    temp is the temperature of the worker's chain, the temperature of the
+    cooling schedule if None. With a neighbor_batch_size above one, each batch
+    of neighbours is evaluated concurrently on evaluation_pool, the process
+    pool every chain shares, and the first accepted in order moves the chain.
+    The neighbours of a batch after the accepted one have already been
+    evaluated by then; they enter the buffer but not the chain, so a batch
+    spends up to neighbor_batch_size - 1 evaluations that do not move it.
+    """
+    if log is None:
+        log = Log_Client()
+    if seed is not None:
+        # seeded by the master so a restarted generation proposes the same moves
+        random.seed(seed)
+        numpy.random.seed(seed)
+
+    # the starting solution of each worker is drawn from the buffer by the master
 
     # activeindex = BufferCost.index(min(BufferCost))
     # active = Buffer[activeindex]
     # activeCost = BufferCost[activeindex]
 
-    temp = self.cooling_schedule.temperature
+    if temp is None:
+        temp = self.cooling_schedule.temperature
     PAR = 0
     PAR2 = 0
 
@@ -187,46 +398,71 @@ def SA(x, k, active, Buffer, BufferCost, self, opt):
     solutionsfitness = []
     NewSolutionSA = [active]
     NewSolutionCost = [active.fitness]
-    for number in range(self.file_settings['optimization']['population_size']):
-        challenge = self.solution()
-        challenge.genome = self.mutation.reproduce(active.genome)
-        challenge.name = f"child_{x}_{k}_{number}"
-        challenge.parameters = copy.deepcopy(self.file_settings['optimization']['objectives'])
-        challenge.add_additional_information(self.file_settings)
-        challenge.evaluate()
-        all_values = open('all_value_tracker.txt','a')
-        all_values.write(f"{challenge.name},    ")
-        for param in challenge.parameters:
-            all_values.write(f"{challenge.parameters[param]['value']},    ")
-        all_values.write('\n')
-        all_values.close()
-
-        test = [challenge]
-        test = self.fitness.calculate(test)
-
-        # determining which solution makes the next generation
-        acceptance = numpy.exp(-1 * (challenge.fitness - active.fitness) / temp)
-        if challenge.fitness < active.fitness:
-            PAR += 1
-            PAR2 += 1
-            active = copy.deepcopy(challenge)
-
-        elif random.uniform(0, 1) < acceptance:
-            PAR += 1
-            PAR2 += acceptance
-            active = challenge
-
-        if x <= self.file_settings['optimization']['number_of_generations'] / 2:
-            temp = temp * 0.9
-
-        NewSolutionSA.append(challenge)
-        NewSolutionCost.append(challenge.fitness)
-        solutions.append(active)
-        solutionsfitness.append(active.fitness)
-
-    return (solutions, solutionsfitness, NewSolutionCost, NewSolutionSA, PAR, PAR2)
-
-def SA_prun(k, self):
+
+    # neighbours are proposed from the active solution in batches and evaluated
+    # concurrently, then examined in order until the first one is accepted.
+    # Neighbours after it were proposed from a superseded state, so they only
+    # enter the buffer and not the chain.
+    population_size = self.file_settings['optimization']['population_size']
+    moves = 0  # neighbours examined by the chain, for the acceptance ratio
+    avoided = 0
+    evaluated = 0  # neighbours simulated, whether the chain examined them or not
+    number = 0
+    while number < population_size:
+        batch = []
+        for b in range(min(self.neighbor_batch_size, population_size - number)):
+            challenge = self.solution()
+            challenge.genome = self.propose(active.genome)
+            challenge.name = f"child_{x}_{k}_{number}"
+            challenge.parameters = copy.deepcopy(self.file_settings['optimization']['objectives'])
+            challenge.add_additional_information(self.file_settings)
+            batch.append(challenge)
+            number += 1
+
+        accepted = False
+        # the evaluations run in the shared pool's processes, logging stays in the chain
+        for challenge, source in self.evaluate_batch(batch, active, evaluation_pool):
+            if source == 'evaluated':
+                evaluated += 1
+                log.journal(challenge)
+                if self.visited is not None:
+                    self.visited.add(challenge, x)
+            elif source == 'visited':
+                avoided += 1
+
+            test = [challenge]
+            test = self.fitness.calculate(test)
+            log.record(challenge, generation=x, worker=k)
+            NewSolutionSA.append(challenge)
+            NewSolutionCost.append(challenge.fitness)
+            if accepted:
+                continue
+            moves += 1
+
+            # determining which solution makes the next generation
+            acceptance = numpy.exp(-1 * (challenge.fitness - active.fitness) / temp)
+            if challenge.fitness < active.fitness:
+                PAR += 1
+                PAR2 += 1
+                active = copy.deepcopy(challenge)
+                accepted = True
+
+            elif random.uniform(0, 1) < acceptance:
+                PAR += 1
+                PAR2 += acceptance
+                active = challenge
+                accepted = True
+
+            # replicas hold their rung of the ladder for the whole generation
+            if x <= self.file_settings['optimization']['number_of_generations'] / 2 and not self.replica_exchange:
+                temp = temp * 0.9
+
+            solutions.append(active)
+            solutionsfitness.append(active.fitness)
+
+    return (solutions, solutionsfitness, NewSolutionCost, NewSolutionSA, PAR, PAR2, moves, avoided, evaluated)
+
+def SA_prun(k, self, log=None):
     # creates a single initial solution
     active = self.solution()
     # active.genome = self.mutation.reproduce(active.genome)
@@ -243,47 +479,71 @@ def SA_prun(k, self):
         active.generate_initial(self.file_settings['genome']['chromosomes'])
 
     active.evaluate()
-    all_values = open('all_value_tracker.txt','a')
-    all_values.write(f"{active.name},    ")
-    for param in active.parameters:
-        all_values.write(f"{active.parameters[param]['value']},    ")
-    all_values.write('\n')
-    all_values.close()
+    if log is None:
+        log = Log_Client()
+    log.journal(active)
     
     one = []
     one.append(active)
     one = self.fitness.calculate(one)
+    log.record(active, worker=k)
     print('calculation {}, fitness = {}'.format(k,active.fitness))
 
 
     return (active)
 
-def SetInitial(self):
+def initial_temperature(costs):
     """
-    Created by Jake Mikouchi
-    2/10/23
+    Returns the initial temperature estimated from the costs of a random
+    sample, or None if the sample is too small to estimate it.
     """
-    # ---------------------------------------------------------------------------------------------------
-    Buffer = []
-    for w in range(self.file_settings['optimization']['buffer_length']):
-        active = self.solution()
-
-        active.name = f"start_solution_{w}"
-        active.parameters = copy.deepcopy(self.file_settings['optimization']['objectives'])
-        active.add_additional_information(self.file_settings)
-
-        active.generate_initial(self.file_settings['genome']['chromosomes'])
-        active.evaluate()
-        Buffer.append(active)
-    Buffer = self.fitness.calculate(Buffer)
-    BufferCost = [Buffer[i].fitness for i in range(len(Buffer))]
-
+    if len(costs) < 2:
+        return None
     # a > 1.0 and a < 2.0
     a = 1.5
-    deviation = statistics.stdev(BufferCost)
     # find standard deviation of the costs and caluclate
     # the initaial temp from the standard deviation
-    initialtemp = a * deviation
+    return a * statistics.stdev(costs)
+
+
+def SetInitial(self, ctx=None, log=None, sample_size=None, seed_size=None):
+    """
+    Created by Jake Mikouchi
+    2/10/23
+
+    Evaluates a random sample of solutions in one parallel batch. The seed_size
+    lowest cost solutions of the sample seed the buffer. When the initial
+    temperature is to be estimated, it is estimated from the whole sample,
+    and returned as None for a sample of fewer than two solutions.
+
+    Parameters:
+        ctx: multiprocessing context
+            Context of the evaluation pool.
+        log: Class
+            Log_Client the workers ship their records through.
+        sample_size: int
+            Number of random solutions evaluated. Defaults to buffer_length.
+        seed_size: int
+            Number of sampled solutions that seed the buffer. Defaults to all of them.
+    """
+    # ---------------------------------------------------------------------------------------------------
+    if ctx is None:
+        ctx = multiprocessing
+    if sample_size is None:
+        sample_size = self.file_settings['optimization']['buffer_length']
+    if seed_size is None:
+        seed_size = sample_size
+    with solver_pool(self.runtime, self.num_procs, ctx) as p:
+        Sample = p.starmap(SA_prun, [(k, self, log) for k in range(sample_size)])
+    Sample = self.fitness.calculate(Sample)
+    SampleCost = [Sample[i].fitness for i in range(len(Sample))]
+
+    initialtemp = None
+    if self.estimate_initial_temperature:
+        initialtemp = initial_temperature(SampleCost)
+    seeds = sorted(range(len(Sample)), key=lambda i: SampleCost[i])[:seed_size]
+    Buffer = [Sample[i] for i in seeds]
+    BufferCost = [SampleCost[i] for i in seeds]
     # -----------------------------------------------------------------------------------------------------
     return (Buffer, BufferCost, initialtemp)
 
@@ -307,6 +567,7 @@ class SimulatedAnnealing(object):
         self.mutation = mutation
         self.num_procs = num_procs
         self.file_settings = file_settings
+        self.journal_entries = {}  # Evaluations replayed from the journal, keyed by genome.
         self.number_generations_post_cleanup = 300  # Arbitrarily chosen default.
         if 'cleanup' in file_settings['optimization']:
             if file_settings['optimization']['cleanup']['perform']:
@@ -315,10 +576,66 @@ class SimulatedAnnealing(object):
                 self.perform_cleanup = False
         else:
             self.perform_cleanup = False
+        self.registry = Solution_Registry(cleanup_action(file_settings['optimization'].get('cleanup')))  # Solution directories not yet cleaned up.
+        self.checkpoint_file = 'sa_checkpoint.pkl'
+        self.checkpoint_frequency = 1  # Generations between checkpoints.
+        if 'checkpoint' in file_settings['optimization']:
+            if 'file' in file_settings['optimization']['checkpoint']:
+                self.checkpoint_file = file_settings['optimization']['checkpoint']['file']
+            if 'frequency' in file_settings['optimization']['checkpoint']:
+                self.checkpoint_frequency = int(file_settings['optimization']['checkpoint']['frequency'])
+        self.initial_sample_size = file_settings['optimization']['buffer_length']  # Random solutions evaluated at startup.
+        self.initial_seed_size = None  # Sampled solutions seeding the buffer, all of them if None.
+        self.estimate_initial_temperature = False  # Replaces the initial temperature with the sample estimate.
+        if 'initial_buffer' in file_settings['optimization']:
+            if 'sample_size' in file_settings['optimization']['initial_buffer']:
+                self.initial_sample_size = int(file_settings['optimization']['initial_buffer']['sample_size'])
+            if 'seed_size' in file_settings['optimization']['initial_buffer']:
+                self.initial_seed_size = int(file_settings['optimization']['initial_buffer']['seed_size'])
+            if 'estimate_temperature' in file_settings['optimization']['initial_buffer']:
+                self.estimate_initial_temperature = bool(file_settings['optimization']['initial_buffer']['estimate_temperature'])
+        self.visited = None  # Memory of recently evaluated genomes, see Visited_States.
+        if 'visited_states' in file_settings['optimization']:
+            visited_settings = file_settings['optimization']['visited_states']
+            if visited_settings['perform']:
+                self.visited = Visited_States(visited_settings.get('size', 10000),
+                                              visited_settings.get('time_to_live', 10),
+                                              visited_settings.get('policy', 'serve'),
+                                              visited_settings.get('retries', 10))
+        self.speculation_depth = 1  # Steps of the serial chain evaluated ahead of time, see main_in_serial.
+        if 'speculation_depth' in file_settings['optimization']:
+            # a tree deeper than the pool can evaluate at once only adds waste
+            self.speculation_depth = max(1, min(int(file_settings['optimization']['speculation_depth']),
+                                                int(math.log2(num_procs + 1))))
+        self.neighbor_batch_size = 1  # Neighbours each SA chain evaluates concurrently.
+        if 'neighbor_batch_size' in file_settings['optimization']:
+            self.neighbor_batch_size = max(1, int(file_settings['optimization']['neighbor_batch_size']))
+        self.neighbor_pool_size = num_procs*self.neighbor_batch_size  # Processes of the pool the chains share for their batches.
+        if 'neighbor_pool_size' in file_settings['optimization']:
+            self.neighbor_pool_size = max(1, int(file_settings['optimization']['neighbor_pool_size']))
+        self.replica_exchange = False  # Each worker runs its own chain on a temperature ladder.
+        self.swap_frequency = 1  # Generations between replica exchanges.
+        self.temperature_ratio = 10.  # Ratio of the hottest to the coldest replica temperature.
+        if 'replica_exchange' in file_settings['optimization']:
+            if file_settings['optimization']['replica_exchange']['perform']:
+                self.replica_exchange = True
+            if 'swap_frequency' in file_settings['optimization']['replica_exchange']:
+                self.swap_frequency = int(file_settings['optimization']['replica_exchange']['swap_frequency'])
+            if 'temperature_ratio' in file_settings['optimization']['replica_exchange']:
+                self.temperature_ratio = float(file_settings['optimization']['replica_exchange']['temperature_ratio'])
+        self.runtime = runtime_from_settings(file_settings)  # Thread and core layout of the pool workers.
 
     def main_in_serial(self):
         """
         Performs optimization using simulated annealing for a population size of one
+
+        With a speculation_depth k above one, the challengers of the next k
+        steps are evaluated ahead of time on a process pool, for both outcomes
+        of each step. Resolving the k steps takes 2^k - 1 evaluations, of
+        which only k are on the path the chain takes; evaluations of the
+        other branches that already started cannot be stopped and are
+        wasted. The depth is therefore limited to log2(num_procs + 1), the
+        deepest tree the pool evaluates at once.
         """
         opt = Simulated_Annealing_Metric_Toolbox()
 
@@ -343,27 +660,58 @@ class SimulatedAnnealing(object):
         one.append(active)
 
         one = self.fitness.calculate(one)
-
-        for self.generation.current in range(self.generation.total):
-            for number in range(self.population.size):
-                challenge = self.solution()
-                challenge.genome = self.mutation.reproduce(active.genome)
-                challenge.name = "solution_{}_{}".format(self.generation.current, number)
-                challenge.parameters = copy.deepcopy(self.file_settings['optimization']['objectives'])
-                challenge.add_additional_information(self.file_settings)
-                challenge.evaluate()
-
-                test = [challenge]
-                test = self.fitness.calculate(test)
-
-                # determining which solution makes the next generation
-                opt.record_best_and_new_solution(active, challenge, self.cooling_schedule)
-                acceptance = numpy.exp(-1 * (challenge.fitness - active.fitness) / self.cooling_schedule.temperature)
-                if challenge.fitness < active.fitness:
-                    active = copy.deepcopy(challenge)
-                elif random.uniform(0, 1) < acceptance:
-                    active = challenge
-            self.cooling_schedule.update()
+        self.registry.register([active])
+
+        # with a speculation depth above one, the challengers of the next few
+        # steps are evaluated ahead of time for both outcomes of each step
+        speculating = self.speculation_depth > 1
+        with solver_executor(self.runtime, self.num_procs) if speculating else nullcontext() as executor:
+            for self.generation.current in range(self.generation.total):
+                number = 0
+                avoided = 0
+                resolved = []
+                discarded = []
+                while number < self.population.size:
+                    levels = min(self.speculation_depth, self.population.size - number)
+                    tree = self.speculate(executor, active, number, levels)
+                    path = ''
+                    for level in range(levels):
+                        challenge, future, source = tree.pop(path)
+                        if future is not None:
+                            challenge = future.result()
+                        resolved.append(challenge)
+                        if source == 'visited':
+                            avoided += 1
+                        elif self.visited is not None:
+                            self.visited.add(challenge, self.generation.current)
+
+                        test = [challenge]
+                        test = self.fitness.calculate(test)
+
+                        # determining which solution makes the next generation
+                        opt.record_best_and_new_solution(active, challenge, self.cooling_schedule)
+                        acceptance = numpy.exp(-1 * (challenge.fitness - active.fitness) / self.cooling_schedule.temperature)
+                        if challenge.fitness < active.fitness:
+                            active = copy.deepcopy(challenge)
+                            path += 'a'
+                        elif random.uniform(0, 1) < acceptance:
+                            active = challenge
+                            path += 'a'
+                        else:
+                            path += 'r'
+                    # the branches that were not taken are discarded
+                    for challenge, future, source in tree.values():
+                        if future is not None and not future.cancel():
+                            discarded.append(challenge)
+                    number += levels
+                self.cooling_schedule.update()
+                self.registry.register(resolved + discarded)
+                self.cleanup([active])
+                if self.visited is not None:
+                    self.visited.expire(self.generation.current + 1)
+                    track_file = open('optimization_track_file.txt', 'a')
+                    track_file.write(f"Generation {self.generation.current}: {avoided} simulations avoided \n")
+                    track_file.close()
 
         track_file = open('optimization_track_file.txt', 'a')
         track_file.write("End of Optimization \n")
@@ -371,171 +719,121 @@ class SimulatedAnnealing(object):
 
         # plot the parameters over time
         opt.plotter()
-        self.cleanup()
-
-    def main_in_parallel(self):
-        def UpdateBuffer(Buffer, BufferCost, TSolutions, TSolutionsfitness):
-
-            lenTSolutions = len(TSolutions)
-            NewBuffer = []
-            NewBuffCost = []
-
-            #-----Gets rid of duplicates in Tsolutions and Buffer -------------------------------------------------
-            DummyTSolutionsCost = []
-            DummyTSolutions = []
-            for x in TSolutionsfitness:
-                minTSolutionfitnessindex = TSolutionsfitness.index(x)
-                if x not in DummyTSolutionsCost:
-                    DummyTSolutionsCost.append(x)
-                    DummyTSolutions.append(TSolutions[minTSolutionfitnessindex])
-            # replaces TSolutions with a new list with same contents except no duplicates
-            TSolutions = DummyTSolutions
-            TSolutionsfitness = DummyTSolutionsCost
-
-            DummyBufferCost = []
-            DummyBuffer = []
-            for x in BufferCost:
-                minBufferfitnessindex = BufferCost.index(x)
-                if x not in DummyBufferCost:
-                    DummyBufferCost.append(x)
-                    DummyBuffer.append(Buffer[minBufferfitnessindex])
-            if len(DummyBuffer) < self.file_settings['optimization']['buffer_length']:
-                while len(DummyBuffer) < self.file_settings['optimization']['buffer_length']:
-                    # this solution may be crude but it saves me a lot of coding
-                    DummyBuffer.append(100000)
-                    DummyBufferCost.append(100000)
-            # replaces Buffer with a new list with same contents except no duplicates 
-            Buffer = DummyBuffer
-            BufferCost = DummyBufferCost
-            # --------------------------------------------------------------------------------------------------
-
-            if len(TSolutions) >= self.file_settings['optimization']['buffer_length']:
-                for w in range(self.file_settings['optimization']['buffer_length']):
-                    minTSolutionfitness = min(TSolutionsfitness)
-                    minTSolutionfitnessindex = TSolutionsfitness.index(min(TSolutionsfitness))
-                    minBufferfitness = min(BufferCost)
-                    minBufferfitnessindex = BufferCost.index(min(BufferCost))
-
-                    if minTSolutionfitness <= minBufferfitness:
-                        NewBuffCost.append(minTSolutionfitness)
-                        NewBuffer.append(TSolutions[minTSolutionfitnessindex])
-                        TSolutionsfitness.pop(minTSolutionfitnessindex)
-                        TSolutions.pop(minTSolutionfitnessindex)
-
-                    if minTSolutionfitness > minBufferfitness:
-                        NewBuffCost.append(minBufferfitness)
-                        NewBuffer.append(Buffer[minBufferfitnessindex])
-                        BufferCost.pop(minBufferfitnessindex)
-                        Buffer.pop(minBufferfitnessindex)
-
-            if lenTSolutions < self.file_settings['optimization']['buffer_length']:
-                for w in range(len(TSolutions)):
-                    Buffer.pop(BufferCost.index(max(BufferCost)))
-                    BufferCost.pop(BufferCost.index(max(BufferCost)))
-                Buffer.extend(TSolutions)
-                BufferCost.extend(TSolutionsfitness)
-                NewBuffer = Buffer
-                NewBuffCost = BufferCost
-
-            return NewBuffer, NewBuffCost
+        self.cleanup([active])
+        self.registry.stop()
 
-        def UpdateActive(temp, Buffer, BufferCost):
-            # finds the sum of the probability of each position in the Buffer
-            scalingfactor = 100
-            SumProb = 0
-            for i in range(len(BufferCost)):
-                CurrProb = numpy.exp((-1 * BufferCost[i]) / scalingfactor)
-                SumProb += CurrProb
+    def propose(self, genome):
+        """
+        Returns a neighbour of the genome. Under the 'reject' policy of the
+        visited state memory, remembered genomes are proposed again.
+        """
+        challenge_genome = self.mutation.reproduce(genome)
+        if self.visited is not None and self.visited.policy == 'reject':
+            for attempt in range(self.visited.retries):
+                if self.visited.lookup(challenge_genome) is None:
+                    break
+                challenge_genome = self.mutation.reproduce(genome)
 
-            # finds the probability that each position of the buffer will be selected
-            PositionProb = []
-            for i in range(len(BufferCost)):
-                CurrProb = numpy.exp((-1 * BufferCost[i]) / scalingfactor)
-                TotalProb = (CurrProb / SumProb)
-                PositionProb.append(TotalProb)
-
-            # uses the probabilities to select which lists to add to the buffer
-            SumProblist = []
-            for i in range(len(Buffer)):
-                if i >= 1:
-                    SumProblist.append(SumProblist[i - 1] + PositionProb[i])
-                if i == 0:
-                    SumProblist.append(PositionProb[i])
-
-            randomnum = random.uniform(0, 1)
-
-            for i in range(len(Buffer)):
-                if i == 0:
-                    if randomnum < SumProblist[i]:
-                        acceptedlist = Buffer[i]
-                        acceptedlistCost = BufferCost[i]
-                        break
-                if i >= 1:
-                    if randomnum < SumProblist[i] and randomnum >= SumProblist[i - 1]:
-                        acceptedlist = Buffer[i]
-                        acceptedlistCost = BufferCost[i]
-                        break
-
-            return acceptedlist, acceptedlistCost
+        return challenge_genome
+
+    def known_challenge(self, challenge):
+        """
+        Fills in the objective values of a challenger if they are already
+        known. Returns the challenger and where its values came from,
+        'visited' for the visited state memory or 'journal' for a replayed
+        journal entry, or None if the challenger has to be evaluated.
+        """
+        if self.visited is not None:
+            entry = self.visited.lookup(challenge.genome)
+            if entry:
+                return replay_entry(challenge, entry), 'visited'
+        entry = self.journal_entries.get(genome_key(challenge.genome))
+        if entry:
+            return replay_entry(challenge, entry), 'journal'
+
+        return None
+
+    def evaluate_batch(self, batch, parent, evaluation_pool=None):
+        """
+        Returns the challengers of a batch in order, each with where its
+        values came from as in known_challenge, or 'evaluated'. The
+        challengers whose values are not known are evaluated from the parent,
+        through delta evaluation when the solution class supports it,
+        together on the evaluation pool, or one after the other in this
+        process without one.
+        """
+        results = [self.known_challenge(challenge) for challenge in batch]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if evaluation_pool is None or len(pending) < 2:
+            evaluated = [evaluate_from_parent(batch[i], parent) for i in pending]
+        else:
+            evaluated = evaluation_pool.starmap(evaluate_from_parent, [(batch[i], parent) for i in pending])
+        for i, challenge in zip(pending, evaluated):
+            results[i] = (challenge, 'evaluated')
+
+        return results
+
+    def speculate(self, executor, active, number, levels):
+        """
+        Submits the challengers of the next levels steps of the serial chain.
+
+        The challengers form a binary tree keyed by the path of outcomes that
+        leads to them, 'a' for an accepted and 'r' for a rejected step. The
+        challenger at a path is proposed from the active solution that path
+        would leave, so whichever path the chain takes, its challengers were
+        drawn exactly as a serial chain would draw them. Challengers on the
+        all-rejected path keep the names a serial chain would give them.
+
+        Returns a dictionary mapping each path to the challenger, the future
+        of its evaluation on the executor and where its values came from. The
+        future is None for challengers whose values were already known or
+        that were evaluated in this process, without an executor.
+        """
+        tree = {}
+        frontier = [('', active.genome, active)]
+        for level in range(levels):
+            branches = []
+            for path, genome, parent in frontier:
+                challenge = self.solution()
+                challenge.genome = self.propose(genome)
+                challenge.name = "solution_{}_{}".format(self.generation.current, number + level)
+                if 'a' in path:
+                    challenge.name += f"_{path}"
+                challenge.parameters = copy.deepcopy(self.file_settings['optimization']['objectives'])
+                challenge.add_additional_information(self.file_settings)
+                known = self.known_challenge(challenge)
+                if known is not None:
+                    tree[path] = (known[0], None, known[1])
+                elif executor is None:
+                    tree[path] = (evaluate_from_parent(challenge, parent), None, 'evaluated')
+                else:
+                    tree[path] = (challenge, executor.submit(evaluate_from_parent, challenge, parent), 'evaluated')
+                if level + 1 < levels:
+                    # an accepted challenger is still being evaluated, so its
+                    # own challengers cannot be evaluated from it
+                    branches.append((path + 'r', genome, parent))
+                    branches.append((path + 'a', challenge.genome, None))
+            frontier = branches
+
+        return tree
+
+    def main_in_parallel(self, restart=False):
+        """
+        Performs optimization using parallel simulated annealing.
+
+        Parameters:
+            restart: bool
+                Resumes the optimization from the last checkpoint, replaying
+                evaluations journaled after it.
+        """
+        def UpdateActive(temp, Buffer, BufferCost):
+            # draws one starting solution per worker from the buffer
+            positions = boltzmann_sample(BufferCost, BUFFER_SCALING_FACTOR, size=self.num_procs)
+            return [Buffer[i] for i in positions], [BufferCost[i] for i in positions]
 
         def InitialSolution(temp, Buffer, BufferCost):
-            # finds the sum of the probability of each position in the Buffer
-            SumProb = 0
-            for i in range(len(Buffer)):
-                CurrProb = numpy.exp((-1 * BufferCost[i]) / temp)
-                SumProb += CurrProb
-
-            # finds the probability that each position of the buffer will be selected
-            PositionProb = []
-            for i in range(len(Buffer)):
-                CurrProb = numpy.exp((-1 * BufferCost[i]) / temp)
-                TotalProb = (CurrProb / SumProb)
-                PositionProb.append(TotalProb)
-
-            # uses the probabilities to select which lists to add to the buffer
-            SumProblist = []
-            for i in range(len(Buffer)):
-                if i >= 1:
-                    SumProblist.append(SumProblist[i - 1] + PositionProb[i])
-                if i == 0:
-                    SumProblist.append(PositionProb[i])
-            randomnum = numpy.random.rand()
-            for i in range(len(Buffer)):
-                if i == 0:
-                    if randomnum < SumProblist[i]:
-                        acceptedlist = Buffer[i]
-                        break
-                if i >= 1:
-                    if randomnum < SumProblist[i] and randomnum > SumProblist[i - 1]:
-                        acceptedlist = Buffer[i]
-                        break
-
-            return acceptedlist
-
-
-        def InitialTemp(self,ctx):
-
-            # calculates the initial temperature based on the standard deviations
-            # of costs when the probability is 100%
-            Buffer = []
-            costs = []
-            # a > 1.0 and a < 2.0
-            a = 1.5
-            ninit = self.file_settings['optimization']['buffer_length']
-            with ctx.Pool(processes=self.num_procs, ) as p:
-                data = p.starmap(SA_prun, [(k, self) for k in range(ninit)])
-
-            for active in data:
-                costs.append(active.fitness)
-                Buffer.append(active)
-
-            deviation = statistics.stdev(costs)
-
-            # find standard deviation of the costs and caluclate
-            # the initaial temp from the standard deviation
-            initialtemp = a * deviation
-
-            return (initialtemp, Buffer)
+            return Buffer[boltzmann_sample(BufferCost, temp)]
+
 
         # Lam cooling schedule
         def LAM(currtemp, deviation, MoveAcceptanceRatio):
@@ -571,41 +869,79 @@ class SimulatedAnnealing(object):
                         deviation = statistics.stdev(STDCostlist)
             return deviation
 
-        SetStart = 0
-        # SetStart determines if initial buffer will be set or completely random
-        # if SetStart is 0, then the buffer will be random
-        # if SetStart is 1, Buffer will be predetemined
-
         multiprocessing.set_start_method("spawn")
         ctx = multiprocessing.get_context('spawn')
 
-        all_value_count = 0
-        all_values = open('all_value_tracker.txt','w')
-        all_values.close()
-
-        if SetStart == 0:
-            initial_temp, Buffer = InitialTemp(self,ctx)
-            Buffer = self.fitness.calculate(Buffer)
-            BufferCost = [Buffer[i].fitness for i in range(len(Buffer))]
-
-        if SetStart == 1:
-            Buffer, BufferCost, initial_temp = SetInitial(self)
-            self.cooling_schedule.temperature = initial_temp
+        # workers ship their records to a single writer in this process
+        mode = 'a' if restart else 'w'
+        all_values = Result_Store(mode=mode)
+        journal = Evaluation_Journal(mode=mode)
+        shipper = Log_Shipper(all_values, ctx, journal=journal)
+        log = shipper.client()
+
+        buffer = Solution_Buffer(self.file_settings['optimization']['buffer_length'])
+        if restart:
+            log.write('optimization_track_file.txt', "Restarting Optimization \n")
+            state = self.load_checkpoint(all_values)
+            buffer.merge(state['buffer'], state['buffer_cost'])
+            Buffer, BufferCost = buffer.contents()
+            ActiveList = state['active']
+            BestSolution = state['best_solution']
+            BestSolutionCost = state['best_solution_cost']
+            start_generation = state['generation'] + 1
+            # directories written before the interruption are cleaned up as the run goes on
+            self.registry.register(Buffer + ActiveList + [BestSolution])
+            # lets the workers replay evaluations finished after the checkpoint
+            self.journal_entries = dict(journal.entries)
+        else:
+            track_file = open('optimization_track_file.txt', 'w')
+            track_file.close()
+            log.write('optimization_track_file.txt', "Beginning Optimization \n")
+
+            # one parallel batch both seeds the buffer and estimates the initial temperature
+            Buffer, BufferCost, initial_temp = SetInitial(self, ctx, log, self.initial_sample_size,
+                                                          self.initial_seed_size)
+            if initial_temp is not None:
+                self.cooling_schedule.temperature = initial_temp
+
+            buffer.merge(Buffer, BufferCost)
+            Buffer, BufferCost = buffer.contents()
+            self.registry.register(Buffer)
+
+            active = InitialSolution(self.cooling_schedule.temperature, Buffer, BufferCost)
+            if self.replica_exchange:
+                # replicas start from their own draws from the buffer
+                ActiveList, ActiveCostList = UpdateActive(self.cooling_schedule.temperature, Buffer, BufferCost)
+            else:
+                # every worker starts the first generation from the same solution
+                ActiveList = [active]*self.num_procs
+            BestSolution = active
+            BestSolutionCost = active.fitness
+            start_generation = 0
 
         opt = Simulated_Annealing_Metric_Toolbox()
-
-        track_file = open('optimization_track_file.txt', 'w')
-        track_file.write("Beginning Optimization \n")
-        track_file.close()
-
-        active = InitialSolution(self.cooling_schedule.temperature, Buffer, BufferCost)
-        BestSolution = active
-        BestSolutionCost = active.fitness
+        meter = Throughput_Meter(pool_layout(self.runtime, self.num_procs))
+        evaluation_manager = None
+        evaluation_pool = None
+        if self.neighbor_batch_size > 1:
+            # the chains share one pool of processes for their neighbour batches
+            evaluation_manager = Evaluation_Manager(ctx=ctx)
+            evaluation_manager.start()
+            evaluation_pool = evaluation_manager.Evaluation_Pool(self.runtime, self.neighbor_pool_size)
 
         
-        for x in range(self.file_settings['optimization']['number_of_generations']):
-            with ctx.Pool(processes=self.num_procs, ) as p:
-                data = p.starmap(SA, [(x, k, active, Buffer, BufferCost, self, opt) for k in range(self.num_procs)])
+        for x in range(start_generation, self.file_settings['optimization']['number_of_generations']):
+            seeds = [random.getrandbits(32) for k in range(self.num_procs)]
+            if self.replica_exchange:
+                # the cooling schedule sets the coldest rung, the rest of the ladder follows it
+                ladder = temperature_ladder(self.cooling_schedule.temperature, self.num_procs, self.temperature_ratio)
+            else:
+                ladder = [None]*self.num_procs
+            meter.start()
+            with solver_pool(self.runtime, self.num_procs, ctx) as p:
+                data = p.starmap(SA, [(x, k, ActiveList[k], Buffer, BufferCost, self, opt, log, seeds[k], ladder[k], evaluation_pool)
+                                      for k in range(self.num_procs)])
+            self.journal_entries = {}
 
             # data collection
             # create list of the costs of the values from data
@@ -616,6 +952,9 @@ class SimulatedAnnealing(object):
 
             TotalMoves = 0
             TotalAcceptanceProbability = 0
+            TotalExamined = 0
+            TotalAvoided = 0
+            TotalEvaluated = 0
             for i in range(len(data)):
                 TSolutions.extend(data[i][0])
                 TSolutionsfitness.extend(data[i][1])
@@ -623,19 +962,42 @@ class SimulatedAnnealing(object):
                 NewSolutionsfitness.extend(data[i][2])
                 TotalMoves += data[i][4]
                 TotalAcceptanceProbability += data[i][5]
+                TotalExamined += data[i][6]
+                TotalAvoided += data[i][7]
+                TotalEvaluated += data[i][8]
+            meter.stop(TotalEvaluated)
 
             # determines move Move Acceptance Method
             # if 0 move acceptance is determined by total number of times a move is made by probability
             # if 1 move acceptance is determined by the sum of all probabilities
             MoveAcceptanceMethod = self.file_settings['optimization']['Move_Acceptance_Method']
             if MoveAcceptanceMethod == 0:
-                MoveAcceptanceRatio = TotalMoves / (self.num_procs * self.file_settings['optimization']['population_size'])
+                MoveAcceptanceRatio = TotalMoves / TotalExamined
             else:
-                MoveAcceptanceRatio = TotalAcceptanceProbability / (self.num_procs * self.file_settings['optimization']['population_size'])
+                MoveAcceptanceRatio = TotalAcceptanceProbability / TotalExamined
             # update Buffer
-            Buffer, BufferCost = UpdateBuffer(Buffer, BufferCost, NewSolutions, NewSolutionsfitness)
-            # update active solution
-            active, activeCost = UpdateActive(self.cooling_schedule.temperature, Buffer, BufferCost)
+            buffer.merge(NewSolutions, NewSolutionsfitness)
+            Buffer, BufferCost = buffer.contents()
+            self.registry.register(NewSolutions)
+            if self.visited is not None:
+                # the workers' memories are merged back for the next generation
+                for solution in NewSolutions:
+                    self.visited.add(solution, x)
+                self.visited.expire(x + 1)
+                log.write('optimization_track_file.txt', f"Generation {x}: {TotalAvoided} simulations avoided \n")
+            # update the active solution of each worker
+            if self.replica_exchange:
+                # each replica continues its own chain, swapping with its neighbours
+                ActiveList = [data[k][0][-1] for k in range(self.num_procs)]
+                ActiveCostList = [data[k][1][-1] for k in range(self.num_procs)]
+                if (x + 1) % self.swap_frequency == 0:
+                    parity = ((x + 1) // self.swap_frequency) % 2
+                    ActiveList, ActiveCostList, swaps = replica_exchange(ActiveList, ActiveCostList, ladder, parity)
+                    pairs = len(range(parity, self.num_procs - 1, 2))
+                    log.write('optimization_track_file.txt', f"Generation {x}: {swaps} of {pairs} replica exchanges accepted \n")
+            else:
+                ActiveList, ActiveCostList = UpdateActive(self.cooling_schedule.temperature, Buffer, BufferCost)
+            active = ActiveList[0]
 
 
             for i in range(len(BufferCost)):
@@ -648,46 +1010,80 @@ class SimulatedAnnealing(object):
             self.cooling_schedule.temperature = temp
 
             opt.record_best_and_new_solution(BestSolution, active, self.cooling_schedule)
-        track_file = open('optimization_track_file.txt', 'a')
-        track_file.write("End of Optimization \n")
-        track_file.close()
+            self.generation.current = x
+            self.cleanup(Buffer + ActiveList + [BestSolution])
+            if (x + 1) % self.checkpoint_frequency == 0:
+                shipper.sync()
+                self.write_checkpoint(all_values, x, Buffer, BufferCost, ActiveList, BestSolution, BestSolutionCost)
+        if evaluation_manager is not None:
+            evaluation_pool.terminate()
+            evaluation_manager.shutdown()
+        log.write('optimization_track_file.txt', meter.summary())
+        log.write('optimization_track_file.txt', "End of Optimization \n")
+        shipper.stop()
 
         # plot the parameters over time
         opt.plotter()
-        self.cleanup()
+        self.registry.stop()
+
+    def restart_main_in_parallel(self):
+        """
+        Resumes a parallel simulated annealing optimization from its last checkpoint.
+
+        Simulated annealing keeps no other restart state, so a FileNotFoundError
+        is raised if no checkpoint was written.
+        """
+        if not os.path.isfile(self.checkpoint_file):
+            raise FileNotFoundError(f"No simulated annealing checkpoint {self.checkpoint_file} to restart from. "
+                                    "The run was interrupted before its first checkpoint, start it again "
+                                    "without restarting.")
+        self.main_in_parallel(restart=True)
+
+    def write_checkpoint(self, all_values, generation, Buffer, BufferCost, ActiveList, BestSolution, BestSolutionCost):
+        """
+        Writes a binary checkpoint of the parallel simulated annealing state
+        after the given generation. The buffer, temperature, the active
+        solution of each worker, the best solution, and the random number generator states of the master are
+        saved. The checkpoint only holds the buffer sized state, so writing it
+        costs a small fraction of a generation.
+        """
+        state = {'generation': generation,
+                 'buffer': Buffer,
+                 'buffer_cost': BufferCost,
+                 'temperature': self.cooling_schedule.temperature,
+                 'active': ActiveList,
+                 'best_solution': BestSolution,
+                 'best_solution_cost': BestSolutionCost,
+                 'all_value_count': all_values.count,
+                 'visited_states': None if self.visited is None else self.visited.states,
+                 'rng_state': capture_rng_state()}
+        write_checkpoint(self.checkpoint_file, 'SimulatedAnnealing', generation, state)
+
+    def load_checkpoint(self, all_values):
+        """
+        Restores the temperature and random number generator states from the
+        binary checkpoint and returns the saved state. Records in the result
+        store written after the checkpoint are discarded.
+        """
+        metadata, state = read_checkpoint(self.checkpoint_file, 'SimulatedAnnealing')
+        self.cooling_schedule.temperature = state['temperature']
+        if self.visited is not None and state.get('visited_states') is not None:
+            self.visited.states = state['visited_states']
+            self.visited.expire(state['generation'] + 1)
+        all_values.truncate(state['all_value_count'])
+        restore_rng_state(state['rng_state'])
+
+        return state
 
-    def cleanup(self):
+    def cleanup(self, keep=()):
         """
         Deletes solution results that are no longer relevant to the optimization.
+        Every registered directory whose solution is not in keep is released to
+        the registry's background thread.
         Written by Brian Andersen 10/28/2020.
         """
         if self.perform_cleanup:
             if self.generation.current <= self.number_generations_post_cleanup:
                 pass
             else:
-                file_name = f'initial_solution'
-                if os.path.isdir(file_name):
-                    delete_file = True
-                    for parent, child in zip(self.population.parents, self.population.children):
-                        if parent.name == file_name:
-                            delete_file = False
-                            break
-                        elif child.name == file_name:
-                            delete_file = False
-                            break
-                    if delete_file:
-                        os.rmdir(file_name)
-                for clgen in range(self.generation.current):
-                    for clpop in range(self.population.size):
-                        file_name = f"solution_{clgen}_{clpop}"
-                        if os.path.isdir(file_name):
-                            delete_file = True
-                            for parent, child in zip(self.population.parents, self.population.children):
-                                if parent.name == file_name:
-                                    delete_file = False
-                                    break
-                                elif child.name == file_name:
-                                    delete_file = False
-                                    break
-                            if delete_file:
-                                os.rmdir(file_name)
+                self.registry.release(keep)
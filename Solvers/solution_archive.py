@@ -0,0 +1,212 @@
+import os
+import json
+import glob
+import shutil
+import tarfile
+import multiprocessing
+from .solution_registry import remove_simulation_output
+
+"""
+This file contains the archival of solution directories. Rather than only
+deleting the simulation output of solutions that are no longer in use, their
+whole directories are streamed by a background process into rolling
+compressed tar archives, and removed from the working directory once the
+archive holding them is closed. An index maps every archived solution to its
+archive and to the offset of its first member in the tar stream, so any
+evaluated loading pattern can be extracted again. Uncompressed archives are
+read from that offset directly; compressed streams cannot be entered at an
+offset, so their members are scanned from the start.
+"""
+
+ARCHIVE_DIRECTORY = 'solution_archive'
+INDEX_FILE = 'index.jsonl'
+
+
+def _archive_names(directory, compression):
+    """
+    Returns the archives already in the directory, in order.
+    """
+    suffix = f".tar.{compression}" if compression else ".tar"
+    return sorted(glob.glob(os.path.join(directory, f"solutions_*{suffix}")))
+
+
+def _close_archive(tar, directory, entries, pending):
+    """
+    Closes an archive, indexes its solutions and removes their directories.
+    """
+    tar.close()
+    with open(os.path.join(directory, INDEX_FILE), 'a') as ofile:
+        for entry in entries:
+            ofile.write(json.dumps(entry) + '\n')
+        ofile.flush()
+        os.fsync(ofile.fileno())
+    for path in pending:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _archive_worker(archive_queue, directory, max_size, compression):
+    """
+    Archives the directories put on the queue until the stop sentinel.
+    """
+    os.makedirs(directory, exist_ok=True)
+    suffix = f".tar.{compression}" if compression else ".tar"
+    number = len(_archive_names(directory, compression))
+    tar = None
+    while True:
+        item = archive_queue.get()
+        if item is None:
+            break
+        name, path = item
+        if not os.path.isdir(path):
+            continue
+        if tar is None:
+            archive_name = f"solutions_{number:05d}{suffix}"
+            tar = tarfile.open(os.path.join(directory, archive_name), f"w:{compression}")
+            entries = []
+            pending = []
+        # the next header is written at the current end of the tar stream
+        entries.append({'name': name,
+                        'archive': archive_name,
+                        'offset': tar.offset})
+        tar.add(path, arcname=name)
+        pending.append(path)
+        if tar.offset >= max_size:
+            _close_archive(tar, directory, entries, pending)
+            tar = None
+            number += 1
+    if tar is not None:
+        _close_archive(tar, directory, entries, pending)
+
+
+class Solution_Archiver(object):
+    """
+    Streams released solution directories into rolling compressed tar archives.
+
+    An instance is used as the action of a Solution_Registry: each released
+    directory is handed to a background process that appends it to the
+    current archive. The process is started by start, which the registry
+    calls from the master before its own background thread runs, so it is
+    never started from a thread other than the main one. An archive is closed once it holds max_size bytes of
+    uncompressed data, and only then are its directories removed, so an
+    interrupted run never loses a solution that is not safely archived.
+
+    Parameters:
+        directory: str
+            Directory holding the archives and their index.
+        max_size: int
+            Uncompressed bytes written to an archive before a new one is started.
+        compression: str
+            Compression of the archives, 'gz', 'bz2', 'xz' or '' for none.
+        ctx: multiprocessing context
+            Context used to start the archiving process.
+    """
+    def __init__(self, directory=ARCHIVE_DIRECTORY, max_size=2**30, compression='gz', ctx=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.compression = compression
+        self.ctx = ctx
+        self.queue = None
+        self.process = None
+
+    def start(self):
+        """
+        Starts the archiving process, if it is not running.
+        """
+        if self.process is None:
+            ctx = self.ctx if self.ctx is not None else multiprocessing
+            self.queue = ctx.Queue()
+            self.process = ctx.Process(target=_archive_worker,
+                                       args=(self.queue, self.directory, self.max_size, self.compression),
+                                       daemon=True)
+            self.process.start()
+
+    def __call__(self, name, path):
+        """
+        Queues a solution directory for archiving.
+        """
+        if self.process is None:
+            raise RuntimeError("Solution_Archiver.start must be called before directories are archived.")
+        self.queue.put((name, path))
+
+    def stop(self):
+        """
+        Closes the current archive and waits for the archiving process to exit.
+        """
+        if self.process is not None:
+            self.queue.put(None)
+            self.process.join()
+            self.queue = None
+            self.process = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['queue'] = None
+        state['process'] = None
+        return state
+
+
+def cleanup_action(cleanup_settings):
+    """
+    Returns the action applied to released solution directories by the
+    optimization.cleanup settings: a Solution_Archiver when an 'archive'
+    entry is given, otherwise deletion of the simulation output.
+    """
+    if not cleanup_settings or not cleanup_settings.get('archive'):
+        return remove_simulation_output
+    archive_settings = cleanup_settings['archive']
+    if not isinstance(archive_settings, dict):
+        archive_settings = {}
+
+    return Solution_Archiver(archive_settings.get('directory', ARCHIVE_DIRECTORY),
+                             int(archive_settings.get('max_size', 2**30)),
+                             archive_settings.get('compression', 'gz'))
+
+
+def read_index(directory=ARCHIVE_DIRECTORY):
+    """
+    Returns the archive index as a dictionary keyed by solution name.
+    """
+    index = {}
+    index_file = os.path.join(directory, INDEX_FILE)
+    if os.path.isfile(index_file):
+        with open(index_file) as ifile:
+            for line in ifile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                index[entry['name']] = entry
+
+    return index
+
+
+def extract_solution(name, destination='.', directory=ARCHIVE_DIRECTORY):
+    """
+    Extracts the directory of an archived solution into destination. Only
+    regular files and directories inside destination are extracted.
+
+    Raises a KeyError if the solution is not in the archive index.
+    """
+    def belongs(member):
+        return member.name == name or member.name.startswith(f"{name}/")
+
+    entry = read_index(directory)[name]
+    archive = os.path.join(directory, entry['archive'])
+    extract_options = {}
+    if hasattr(tarfile, 'data_filter'):
+        extract_options['filter'] = 'data'
+    if archive.endswith('.tar'):
+        # the members of a solution are contiguous from its indexed offset
+        with open(archive, 'rb') as ifile:
+            ifile.seek(entry['offset'])
+            with tarfile.open(fileobj=ifile, mode='r:') as tar:
+                members = []
+                for member in tar:
+                    if not belongs(member):
+                        break
+                    members.append(member)
+                tar.extractall(destination, members=members, **extract_options)
+    else:
+        with tarfile.open(archive) as tar:
+            members = [member for member in tar.getmembers() if belongs(member)]
+            tar.extractall(destination, members=members, **extract_options)
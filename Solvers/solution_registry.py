@@ -0,0 +1,113 @@
+import os
+import queue
+import threading
+
+"""
+This file contains the registry of solution directories used by the solver
+cleanup. Every evaluated solution is registered by name as it is evaluated,
+so cleanup only has to compare the registered directories against the
+solutions still in use, rather than testing every name the optimization could
+have produced. The directories released by cleanup are handed to a
+background thread, so the filesystem work never holds up selection.
+"""
+
+
+def remove_simulation_output(name, path):
+    """
+    Deletes the simulation output of a solution, and its directory once empty.
+    """
+    output = os.path.join(path, f"{name}_sim.out")
+    if os.path.isfile(output):
+        os.remove(output)
+    if os.path.isdir(path) and not os.listdir(path):
+        os.rmdir(path)
+
+
+class Solution_Registry(object):
+    """
+    Registry of the live solution directories of an optimization.
+
+    Parameters:
+        action: function
+            Called in the background thread with the name and path of each
+            released directory. Defaults to remove_simulation_output.
+        directory: str
+            Directory the solution directories are written in.
+    """
+    def __init__(self, action=remove_simulation_output, directory='.'):
+        self.action = action
+        self.directory = directory
+        self.paths = {}  # name -> path of every registered directory not yet released
+        self.queue = None
+        self.thread = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, name):
+        return name in self.paths
+
+    def register(self, solution_list):
+        """
+        Registers the directories of evaluated solutions.
+        """
+        for solution in solution_list:
+            if solution.name not in self.paths:
+                self.paths[solution.name] = os.path.join(self.directory, solution.name)
+
+    def start(self):
+        """
+        Starts the action, if it has to be started, and the background thread.
+        Called from the master, so an action starting a process never starts
+        it from the background thread.
+        """
+        if self.thread is None:
+            if hasattr(self.action, 'start'):
+                self.action.start()
+            self.queue = queue.Queue()
+            self.thread = threading.Thread(target=self._work, daemon=True)
+            self.thread.start()
+
+    def release(self, keep):
+        """
+        Hands every registered directory whose solution is not in keep to the
+        background thread, and forgets it.
+        """
+        self.start()
+        keep_names = set(solution.name for solution in keep)
+        for name in [name for name in self.paths if name not in keep_names]:
+            self.queue.put((name, self.paths.pop(name)))
+
+    def _work(self):
+        """
+        Applies the action to released directories until the stop sentinel.
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            name, path = item
+            try:
+                self.action(name, path)
+            except OSError as error:
+                print(f"Cleanup of {path} failed: {error}")
+
+    def stop(self):
+        """
+        Waits for the released directories to be processed and stops the thread.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = None
+            self.thread = None
+        if hasattr(self.action, 'stop'):
+            self.action.stop()
+
+    def __getstate__(self):
+        # solvers that pickle themselves to pool workers send an empty registry
+        state = self.__dict__.copy()
+        state['paths'] = {}
+        state['queue'] = None
+        state['thread'] = None
+        return state
@@ -0,0 +1,80 @@
+import importlib
+
+"""
+This file contains the registry of the optimization solvers. The registry
+only records the module and class of each solver, and load_solver imports a
+solver module when the solver is selected, so code that looks solvers up by
+name does not import the other solvers. Worker start up is not affected by
+the registry; it depends on what each solver module imports at load, see
+startup_benchmark.
+
+Solvers from other packages are registered with register_solver, or
+declared under the 'midas.solvers' entry point group of their package:
+
+    [project.entry-points."midas.solvers"]
+    my_solver = "my_package.my_module:My_Solver"
+"""
+
+ENTRY_POINT_GROUP = 'midas.solvers'
+
+SOLVERS = {'genetic_algorithm': ('.genetic_algorithm', 'Genetic_Algorithm'),
+           'simulated_annealing': ('.simulated_annealing', 'SimulatedAnnealing'),
+           'parallel_simulated_annealing': ('.simulated_annealing', 'SimulatedAnnealing'),
+           'random_solutions': ('.random_solutions', 'Random_Solution'),
+           'reinforcement_learning': ('.reinforcement_learning', 'Reinforcement_Learning')}
+
+
+def register_solver(name, module, attribute):
+    """
+    Registers a solver class without importing it.
+
+    Parameters:
+        name: str
+            Name the solver is selected by.
+        module: str
+            Module holding the solver. Names starting with '.' are relative
+            to this package.
+        attribute: str
+            Name of the solver class in the module.
+    """
+    SOLVERS[name] = (module, attribute)
+
+
+def _entry_points():
+    """
+    Returns the solver entry points of the installed packages by name.
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return {}
+    found = entry_points()
+    if hasattr(found, 'select'):
+        found = found.select(group=ENTRY_POINT_GROUP)
+    else:
+        found = found.get(ENTRY_POINT_GROUP, [])
+
+    return {entry_point.name: entry_point for entry_point in found}
+
+
+def available_solvers():
+    """
+    Returns the names of every registered solver, none of them imported.
+    """
+    return sorted(set(SOLVERS) | set(_entry_points()))
+
+
+def load_solver(name):
+    """
+    Imports and returns the class of the named solver.
+
+    Raises a KeyError naming the available solvers if the solver is unknown.
+    """
+    if name in SOLVERS:
+        module, attribute = SOLVERS[name]
+        return getattr(importlib.import_module(module, __package__), attribute)
+    plugins = _entry_points()
+    if name in plugins:
+        return plugins[name].load()
+
+    raise KeyError(f"Unknown solver {name}, available solvers are {', '.join(available_solvers())}.")
@@ -0,0 +1,100 @@
+import sys
+import time
+import argparse
+import importlib
+import multiprocessing
+from .solver_registry import SOLVERS
+
+"""
+This file contains a benchmark of the start up cost of solver worker
+processes. With the spawn start method every worker starts a new
+interpreter and imports the modules of the functions it runs, so the
+imports of a solver module are paid again by every worker.
+
+The benchmark starts workers that import the selected solver module as it
+is loaded now, with its heavy dependencies imported lazily, and workers that
+also import the dependencies that solver's module used to import eagerly. It
+reports the time until every worker is ready:
+
+    python -m Solvers.startup_benchmark simulated_annealing --processes 8
+"""
+
+# dependencies each solver module imported at load before they were made lazy,
+# simulated annealing never imported any
+EAGER_IMPORTS = {'.genetic_algorithm': ['h5py', 'yaml'],
+                 '.random_solutions': ['h5py', 'yaml', 'pickle'],
+                 '.simulated_annealing': [],
+                 '.reinforcement_learning': ['matplotlib.pyplot', 'torch', 'stable_baselines3']}
+
+
+def _import_worker(modules, results):
+    """
+    Imports the modules and reports the time taken and any failed import.
+    """
+    start = time.perf_counter()
+    failed = []
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError as error:
+            failed.append(f"{module}: {error}")
+    results.put((time.perf_counter() - start, failed))
+
+
+def spawn_cost(modules, processes=4):
+    """
+    Starts processes spawned workers that each import the modules, and
+    returns the time until all of them finished, the mean import time of a
+    worker and the imports that failed.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    start = time.perf_counter()
+    workers = [ctx.Process(target=_import_worker, args=(modules, results)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    wall_time = time.perf_counter() - start
+    failed = sorted(set(failure for _, worker_failed in reports for failure in worker_failed))
+
+    return {'wall_time': wall_time,
+            'import_time': sum(import_time for import_time, _ in reports) / processes,
+            'failed': failed}
+
+
+def benchmark_solver(name, processes=4):
+    """
+    Returns the spawn cost of the workers of a registered solver, with the
+    solver's dependencies imported lazily and eagerly.
+    """
+    module = SOLVERS[name][0]
+    eager = EAGER_IMPORTS.get(module, [])
+    if module.startswith('.'):
+        module = f"{__package__}{module}"
+
+    return {'lazy': spawn_cost([module], processes),
+            'eager': spawn_cost(eager + [module], processes)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measures the start up cost of spawned solver workers.")
+    parser.add_argument('solver', nargs='?', default='simulated_annealing', choices=sorted(SOLVERS))
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    results = benchmark_solver(args.solver, args.processes)
+    print(f"Spawn cost of {args.processes} {args.solver} workers")
+    for label in ('eager', 'lazy'):
+        result = results[label]
+        print(f"    {label:5s}: {result['wall_time']:.2f} s until all workers are ready, "
+              f"{result['import_time']:.2f} s of imports per worker")
+        for failure in result['failed']:
+            print(f"        not installed, not counted: {failure}")
+    saved = results['eager']['import_time'] - results['lazy']['import_time']
+    print(f"    saved per worker: {saved:.2f} s")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
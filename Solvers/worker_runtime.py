@@ -0,0 +1,297 @@
+import os
+import sys
+import time
+import multiprocessing
+
+"""
+This file contains the runtime settings of the solver worker processes. By
+default every worker's torch and BLAS libraries start a thread per core, so
+num_procs workers, the simulators they launch and the reinforcement learning
+training all compete for the same cores. A Worker_Runtime limits the threads
+of each worker process, and of the processes it launches, and can pin each
+worker to its own cores.
+
+The settings are read from the optimization.worker_runtime entry:
+
+    worker_runtime:
+        threads: 1            # threads of each worker process
+        master_threads: 4     # torch threads of the master process, e.g. SB3 training
+        pin: True             # pins each worker to its own block of cores
+        cpus: [0, 1, 2, 3]    # cores the workers are pinned to, defaults to all available
+
+The measured throughput of every solver pool is written to the
+optimization track file together with its layout, so layouts can be
+compared across runs, and benchmark_layouts measures several layouts on the
+same work directly.
+"""
+
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS')
+
+
+def available_cpus():
+    """
+    Returns the cores the current process may run on.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def set_torch_threads(threads):
+    """
+    Limits the intra-op threads of torch, if it has been imported.
+    """
+    torch = sys.modules.get('torch')
+    if torch is not None and threads:
+        torch.set_num_threads(int(threads))
+
+
+def limit_threads(threads):
+    """
+    Limits the threads of torch, OpenMP and BLAS in the current process and
+    in the processes it launches.
+    """
+    os.environ.update({variable: str(threads) for variable in THREAD_VARIABLES})
+    set_torch_threads(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        pass
+    else:
+        # BLAS libraries already loaded ignore the environment variables
+        threadpool_limits(threads)
+
+
+def next_rank(counter):
+    """
+    Returns the next rank handed out by a shared counter.
+    """
+    with counter.get_lock():
+        rank = counter.value
+        counter.value += 1
+    return rank
+
+
+def apply_runtime(runtime, counter=None):
+    """
+    Pool initializer applying a Worker_Runtime to the worker process. Each
+    worker takes its rank from the counter shared by the workers of its pool,
+    so the ranks of every pool start at 0.
+    """
+    runtime.apply(next_rank(counter) if counter is not None else None)
+
+
+class Worker_Runtime(object):
+    """
+    Thread and core layout of the worker processes of a solver.
+
+    Parameters:
+        threads: int
+            Threads used by torch, OpenMP and BLAS in each worker process.
+        pin: bool
+            Pins each worker to its own block of threads cores.
+        cpus: list
+            Cores the workers are pinned to. Defaults to every core the
+            master process may run on.
+        master_threads: int
+            Torch threads of the master process, e.g. for training or neural
+            network predictions. Left unchanged if None.
+    """
+    def __init__(self, threads=1, pin=False, cpus=None, master_threads=None):
+        self.threads = max(int(threads), 1)
+        self.pin = pin
+        self.cpus = list(cpus) if cpus else None
+        self.master_threads = master_threads
+
+    def environment(self):
+        """
+        Returns the environment variables limiting the threads of a worker
+        and of the simulators it launches.
+        """
+        return {variable: str(self.threads) for variable in THREAD_VARIABLES}
+
+    def worker_cpus(self, rank):
+        """
+        Returns the cores the worker of the given rank is pinned to.
+        """
+        cpus = self.cpus if self.cpus else available_cpus()
+        first = (rank*self.threads) % len(cpus)
+        return [cpus[(first + i) % len(cpus)] for i in range(min(self.threads, len(cpus)))]
+
+    def apply(self, rank=None):
+        """
+        Applies the thread limits, and the pinning, to the current process.
+        The process is pinned to the cores of the given rank, of rank 0 if
+        None.
+        """
+        limit_threads(self.threads)
+        if self.pin and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.worker_cpus(rank or 0))
+
+    def apply_master(self):
+        """
+        Limits the threads of the master process to master_threads, if set.
+        Torch is only limited once it has been imported, so this is called
+        after the libraries the master runs, e.g. the neural network backend,
+        have been loaded.
+        """
+        if self.master_threads:
+            limit_threads(int(self.master_threads))
+
+    def pool(self, processes, ctx=None):
+        """
+        Returns a process pool whose workers run with this runtime. The
+        thread limits are also set while the workers start, so libraries
+        initialized before the initializer runs already see them.
+        """
+        if ctx is None:
+            ctx = multiprocessing
+        previous = {variable: os.environ.get(variable) for variable in THREAD_VARIABLES}
+        os.environ.update(self.environment())
+        try:
+            return ctx.Pool(processes=processes, initializer=apply_runtime, initargs=(self, ctx.Value('i', 0)))
+        finally:
+            for variable, value in previous.items():
+                if value is None:
+                    os.environ.pop(variable, None)
+                else:
+                    os.environ[variable] = value
+
+    def describe(self, processes):
+        """
+        Returns a one line description of the layout of processes workers.
+        """
+        layout = f"{processes} processes x {self.threads} threads"
+        if self.pin:
+            layout += ", pinned"
+        return layout
+
+
+def runtime_from_settings(file_settings):
+    """
+    Returns the Worker_Runtime set by the optimization.worker_runtime entry,
+    or None if there is no entry.
+    """
+    if 'worker_runtime' not in file_settings['optimization']:
+        return None
+    runtime_settings = file_settings['optimization']['worker_runtime']
+    if not isinstance(runtime_settings, dict):
+        runtime_settings = {}
+
+    return Worker_Runtime(runtime_settings.get('threads', 1),
+                          runtime_settings.get('pin', False),
+                          runtime_settings.get('cpus'),
+                          runtime_settings.get('master_threads'))
+
+
+def solver_pool(runtime, processes, ctx=None):
+    """
+    Returns the process pool of a solver, run with the runtime if one is set.
+    """
+    if runtime is not None:
+        return runtime.pool(processes, ctx)
+    if ctx is None:
+        ctx = multiprocessing
+    return ctx.Pool(processes=processes)
+
+
+def solver_executor(runtime, processes, ctx=None):
+    """
+    Returns a process pool executor of a solver, run with the runtime if one
+    is set. Unlike the futures of a pool, its futures can be cancelled until
+    their evaluation starts.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    if runtime is None:
+        return ProcessPoolExecutor(max_workers=processes, mp_context=ctx)
+    if ctx is None:
+        ctx = multiprocessing
+    return ProcessPoolExecutor(max_workers=processes, mp_context=ctx,
+                               initializer=apply_runtime, initargs=(runtime, ctx.Value('i', 0)))
+
+
+def pool_layout(runtime, processes):
+    """
+    Returns the description of the layout of a solver pool.
+    """
+    if runtime is not None:
+        return runtime.describe(processes)
+    return f"{processes} processes, default threads"
+
+
+class Throughput_Meter(object):
+    """
+    Measures the evaluations per second of a solver pool.
+
+    Parameters:
+        layout: str
+            Description of the layout the throughput is measured for.
+    """
+    def __init__(self, layout):
+        self.layout = layout
+        self.count = 0
+        self.seconds = 0.
+        self.started = None
+
+    def start(self):
+        """
+        Starts timing a batch of evaluations.
+        """
+        self.started = time.time()
+
+    def stop(self, count):
+        """
+        Adds count evaluations finished since start.
+        """
+        self.seconds += time.time() - self.started
+        self.count += count
+        self.started = None
+
+    @property
+    def throughput(self):
+        """
+        Evaluations per second over every timed batch.
+        """
+        return self.count / self.seconds if self.seconds else 0.
+
+    def summary(self):
+        """
+        Returns the track file line reporting the measured throughput.
+        """
+        return (f"Throughput with {self.layout}: {self.throughput:.4f} evaluations/s "
+                f"({self.count} evaluations in {self.seconds:.1f} s) \n")
+
+    def report(self, file_name='optimization_track_file.txt'):
+        """
+        Appends the measured throughput to the file.
+        """
+        with open(file_name, 'a') as ofile:
+            ofile.write(self.summary())
+
+
+def benchmark_layouts(function, items, layouts, ctx=None):
+    """
+    Maps the function over the items with every layout and returns the
+    measured throughput of each.
+
+    Parameters:
+        function: function
+            Picklable function evaluated on each item, e.g. evaluate_function.
+        items: list
+            Items evaluated with every layout, e.g. solutions.
+        layouts: list
+            (processes, threads, pin) tuples.
+    """
+    results = []
+    for processes, threads, pin in layouts:
+        runtime = Worker_Runtime(threads, pin)
+        meter = Throughput_Meter(runtime.describe(processes))
+        with runtime.pool(processes, ctx) as pool:
+            meter.start()
+            pool.map(function, items)
+            meter.stop(len(items))
+        results.append({'processes': processes, 'threads': threads, 'pin': pin,
+                        'throughput': meter.throughput})
+
+    return results
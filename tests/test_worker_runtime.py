@@ -0,0 +1,87 @@
+import os
+import multiprocessing
+import pytest
+from Solvers.worker_runtime import (THREAD_VARIABLES, Throughput_Meter, Worker_Runtime,
+                                    apply_runtime, next_rank, pool_layout)
+
+"""
+Tests of the worker runtime and throughput meter, run from the repository
+root with python -m pytest.
+"""
+
+
+def _report_rank(counter, ranks):
+    ranks.put(next_rank(counter))
+
+
+def test_meter_accumulates_batches(monkeypatch):
+    clock = iter([10., 12., 20., 22.])
+    monkeypatch.setattr('Solvers.worker_runtime.time.time', lambda: next(clock))
+    meter = Throughput_Meter("2 processes x 1 threads")
+    meter.start()
+    meter.stop(6)
+    meter.start()
+    meter.stop(2)
+    assert meter.count == 8
+    assert meter.seconds == pytest.approx(4.)
+    assert meter.throughput == pytest.approx(2.)
+    assert meter.summary().startswith("Throughput with 2 processes x 1 threads: 2.0000 evaluations/s")
+
+
+def test_meter_without_batches():
+    assert Throughput_Meter("serial").throughput == 0.
+
+
+def test_environment_limits_threads():
+    runtime = Worker_Runtime(threads=2)
+    assert runtime.environment() == {variable: '2' for variable in THREAD_VARIABLES}
+    assert Worker_Runtime(threads=0).threads == 1
+
+
+def test_worker_cpus_blocks():
+    runtime = Worker_Runtime(threads=2, pin=True, cpus=[4, 5, 6, 7])
+    assert runtime.worker_cpus(0) == [4, 5]
+    assert runtime.worker_cpus(1) == [6, 7]
+    assert runtime.worker_cpus(2) == [4, 5]
+    assert Worker_Runtime(threads=8, cpus=[0, 1]).worker_cpus(0) == [0, 1]
+
+
+def test_describe():
+    assert Worker_Runtime(threads=2).describe(4) == "4 processes x 2 threads"
+    assert Worker_Runtime(pin=True).describe(1) == "1 processes x 1 threads, pinned"
+    assert pool_layout(None, 3) == "3 processes, default threads"
+
+
+def test_apply_sets_environment(monkeypatch):
+    for variable in THREAD_VARIABLES:
+        monkeypatch.delenv(variable, raising=False)
+    apply_runtime(Worker_Runtime(threads=3))
+    assert all(os.environ[variable] == '3' for variable in THREAD_VARIABLES)
+
+
+def test_apply_master_limits_master_threads(monkeypatch):
+    for variable in THREAD_VARIABLES:
+        monkeypatch.delenv(variable, raising=False)
+    Worker_Runtime(threads=1).apply_master()
+    assert not any(variable in os.environ for variable in THREAD_VARIABLES)
+    Worker_Runtime(threads=1, master_threads=4).apply_master()
+    assert all(os.environ[variable] == '4' for variable in THREAD_VARIABLES)
+
+
+def test_ranks_are_handed_out_once():
+    ctx = multiprocessing.get_context('spawn')
+    counter, ranks = ctx.Value('i', 0), ctx.Queue()
+    workers = [ctx.Process(target=_report_rank, args=(counter, ranks)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    handed_out = sorted(ranks.get(timeout=60) for _ in workers)
+    for worker in workers:
+        worker.join()
+    assert handed_out == [0, 1, 2, 3]
+
+
+def test_pool_runs_with_runtime():
+    runtime = Worker_Runtime(threads=1)
+    for _ in range(2):
+        with runtime.pool(2, multiprocessing.get_context('spawn')) as pool:
+            assert pool.map(abs, [-1, -2, 3]) == [1, 2, 3]